@@ -1,24 +1,34 @@
-from typing import List, Optional
+import asyncio
+import contextvars
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
-from llama_index.core.agent.workflow import AgentWorkflow, AgentOutput, ToolCallResult, ToolCall, FunctionAgent
-from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.agent.workflow import AgentWorkflow
 from llama_index.core.workflow import Workflow, Event, step, Context, StartEvent, StopEvent
 from llama_index.core.workflow.handler import WorkflowHandler
 
 from core.advisor_agents import get_principle_rag_agent, get_interviewer_agent, get_adviser_agent, \
-    get_template_update_agent
+    get_template_update_agent, get_principle_query_engine, collect_book_chunks, merge_book_chunks, \
+    retrieve_references, advise
+from core.checkpoint import SessionCheckpoint
+from core.common import run_agent
+from core.index import get_personal_index
 from core.state import get_workflow_state
+from core.template_patch import patch_or_regenerate_template
+from core.warmup import Warmup
+from utils.user_channel import get_user_channel
 
 
-def get_advice_dynamic_workflow(session_id: str, verbose: bool = False):
+def get_advice_dynamic_workflow(session_id: str, verbose: bool = False, warmup: Optional[Warmup] = None):
     state = get_workflow_state(session_id)
     interviewer = get_interviewer_agent(True, ["reference_retriever"])
     retriever = get_principle_rag_agent(True, ["principle_advisor"])
-    principles = state.load_principle_from_cases()
-    profile = state.load_profile()
-    advisor = get_adviser_agent(user_principles=principles, user_profile=profile, is_dynamic_agent=True,
+    profile = warmup.result("profile") if warmup is not None else state.load_profile()
+    # past cases and journals are looked up by the adviser through its personal history tool
+    advisor = get_adviser_agent(user_principles=[], user_profile=profile, is_dynamic_agent=True,
                                 can_handoff_to=["template_updater"])
-    existing_template = state.read_template()
+    existing_template = warmup.result("template") if warmup is not None else state.read_template()
     template_updater = get_template_update_agent(existing_template, is_dynamic_agent=True)
 
     workflow = AgentWorkflow(
@@ -29,26 +39,13 @@ def get_advice_dynamic_workflow(session_id: str, verbose: bool = False):
     return workflow
 
 
-def get_static_workflow(session_id: str, verbose: bool = False):
-    workflow = AdviceWorkFlow(session_id=session_id, verbose=verbose)
+def get_static_workflow(session_id: str, verbose: bool = False, pipelined: bool = False,
+                        warmup: Optional[Warmup] = None, checkpoint: Optional[SessionCheckpoint] = None):
+    workflow = AdviceWorkFlow(session_id=session_id, verbose=verbose, pipelined=pipelined, warmup=warmup,
+                              checkpoint=checkpoint)
     return workflow
 
 
-async def _run_agent(agent: FunctionAgent, question, chat_history: Optional[List[ChatMessage]] = None,
-                     verbose: bool = False):
-    chat_history = [] if chat_history is None else chat_history.copy()
-    chat_history.append(
-        ChatMessage(
-            role="user", content=question,
-        ))
-    handler = agent.run(chat_history=chat_history)
-    if verbose:
-        result = await _verbose_print(handler)
-        return result
-    output = await handler
-    return output.response.content
-
-
 class ReferenceRetrivalEvent(Event):
     question: str
 
@@ -57,7 +54,11 @@ class Advice(Event):
     principles: List[str]
     profile: dict
     question: str
-    book_content: str
+    # retrieved book nodes as (content, similarity score)
+    book_chunks: List[Tuple[str, float]]
+
+    def book_content(self) -> str:
+        return "\n\n".join(content for content, _ in self.book_chunks)
 
 
 class UpdateJournalTemplate(Event):
@@ -66,91 +67,166 @@ class UpdateJournalTemplate(Event):
 
 
 class AdviceWorkFlow(Workflow):
-
-    def __init__(self, verbose: bool = False, session_id: str = None):
+    """
+    Static advice flow: interview -> retrieve -> advice -> update_journal_template.
+
+    In pipelined mode, state and the book index are loaded on a thread pool as soon as the flow is created.
+    Book and personal-history retrieval start on the raw user message while the interviewer is still
+    clarifying, and are refined with the clarified question afterwards instead of running the rewrite agent.
+    Work runs on threads, so it keeps progressing while the interviewer waits for the user.
+
+    The LLM only returns the new content of the sections the advice changes and the template is patched
+    locally. The full template is regenerated when the patch fails, whether on validation or in the LLM call.
+
+    Headless runs do not ask whether to save the updated template and leave it unsaved. Stage outputs and
+    latencies are kept in `outputs` and `stage_latency`. With a checkpoint, every stage output is saved as it
+    completes and stages already in the checkpoint are replayed from it instead of calling the LLM again.
+    """
+    PIPELINE_WORKERS = 4
+
+    def __init__(self, verbose: bool = False, session_id: str = None, pipelined: bool = False,
+                 warmup: Optional[Warmup] = None, headless: bool = False,
+                 checkpoint: Optional[SessionCheckpoint] = None):
         self.uuid = session_id
-        state = get_workflow_state(session_id)
-        self.principles = state.load_principle_from_cases()
-        self.profile = state.load_profile()
+        self.checkpoint = checkpoint
         self.verbose = verbose
+        self.pipelined = pipelined
+        self.headless = headless
+        self.outputs = {}
+        self.stage_latency = {}
+        state = get_workflow_state(session_id)
+        if pipelined:
+            self._executor = ThreadPoolExecutor(max_workers=self.PIPELINE_WORKERS)
+            self._profile = self._warm_or_submit(warmup, "profile", state.load_profile)
+            self._template = self._warm_or_submit(warmup, "template", state.read_template)
+            self._query_engine = self._warm_or_submit(warmup, "query_engine", get_principle_query_engine)
+            self._speculative = None
+        else:
+            self.profile = warmup.result("profile") if warmup is not None else state.load_profile()
         super().__init__(timeout=None, verbose=verbose)
 
+    def run(self, *args, **kwargs) -> WorkflowHandler:
+        handler = super().run(*args, **kwargs)
+        if self.pipelined:
+            # the pool is released however the run ends, including failed or cancelled steps
+            handler.add_done_callback(lambda _: self._executor.shutdown(wait=False, cancel_futures=True))
+        return handler
+
+    def _warm_or_submit(self, warmup: Optional[Warmup], name: str, fn) -> Future:
+        if warmup is not None and warmup.future(name) is not None:
+            return warmup.future(name)
+        return self._submit(fn)
+
+    def _submit(self, fn, *args) -> Future:
+        # pool threads do not inherit the context, pass it on so the session's user state is used
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _record(self, stage: str, started: float, output, saved=None):
+        self.stage_latency[stage] = time.perf_counter() - started
+        self.outputs[stage] = output
+        if self.checkpoint is not None:
+            self.checkpoint.save(f"advice.{stage}", output if saved is None else saved)
+
+    def _saved(self, stage: str):
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.get(f"advice.{stage}")
+
+    def _retrieve_for(self, text: str) -> Tuple[List[Tuple[str, float]], List[str]]:
+        return retrieve_references(self._query_engine.result(), text)
+
     @step
     async def interview(self, ctx: Context,
                         ev: StartEvent) -> ReferenceRetrivalEvent:
         # Step 1: Interviewer agent asks questions to the user
+        saved = self._saved("interview")
+        if saved is not None:
+            self.outputs["interview"] = saved
+            return ReferenceRetrivalEvent(question=saved)
+        started = time.perf_counter()
+        if self.pipelined:
+            self._speculative = self._submit(self._retrieve_for, ev.user_msg)
         interviewer = get_interviewer_agent()
-        question = await _run_agent(interviewer, question=ev.user_msg, verbose=self.verbose)
+        question = await run_agent(interviewer, question=ev.user_msg, verbose=self.verbose)
+        self._record("interview", started, question)
         return ReferenceRetrivalEvent(question=question)
 
     @step
     async def retrieve(self, ctx: Context, ev: ReferenceRetrivalEvent) -> Advice:
         # Step 2: RAG agent retrieves relevant content from the book
-        rag_agent = get_principle_rag_agent()
-        book_content = await _run_agent(rag_agent, question=ev.question, verbose=self.verbose)
-        return Advice(principles=self.principles, profile=self.profile,
-                      question=ev.question, book_content=book_content)
+        saved = self._saved("retrieve")
+        if saved is not None:
+            advice = Advice(**saved)
+            self.outputs["retrieve"] = advice.book_content()
+            return advice
+        started = time.perf_counter()
+        if self.pipelined:
+            advice = await self._pipelined_retrieve(ev)
+        else:
+            rag_agent = get_principle_rag_agent()
+            # the agent only rewrites the question, its tool's scored nodes are what gets packed
+            book_chunks = collect_book_chunks()
+            answer = await run_agent(rag_agent, question=ev.question, verbose=self.verbose)
+            if not book_chunks and answer:
+                book_chunks.append((answer, 0.0))
+            principles = await asyncio.to_thread(get_personal_index().retrieve, ev.question)
+            advice = Advice(principles=principles, profile=self.profile,
+                            question=ev.question, book_chunks=book_chunks)
+        self._record("retrieve", started, advice.book_content(),
+                     saved=dict(principles=advice.principles, profile=advice.profile,
+                                question=advice.question, book_chunks=advice.book_chunks))
+        return advice
+
+    async def _pipelined_retrieve(self, ev: ReferenceRetrivalEvent) -> Advice:
+        if self._speculative is None:
+            # the interview was replayed from a checkpoint, there is no speculative retrieval to refine
+            self._speculative = self._submit(self._retrieve_for, ev.question)
+        # refine the speculative results with the clarified question, keeping the refined ones first
+        refined = self._submit(self._retrieve_for, ev.question)
+        (book_chunks, principles), (speculative_chunks, speculative_principles) = await asyncio.gather(
+            asyncio.wrap_future(refined), asyncio.wrap_future(self._speculative))
+        book_chunks = merge_book_chunks(book_chunks, speculative_chunks)
+        principles = list(dict.fromkeys(principles + speculative_principles))
+        profile = await asyncio.wrap_future(self._profile)
+        return Advice(principles=principles, profile=profile,
+                      question=ev.question, book_chunks=book_chunks)
 
     @step
     async def advice(self, ctx: Context, ev: Advice) -> UpdateJournalTemplate:
         # Step 3: Adviser agent provides advice based on the user's profile, principles, and book content
-        advisor = get_adviser_agent(ev.profile, ev.principles, ev.book_content)
-        advice = await _run_agent(advisor, question=ev.question, verbose=self.verbose)
+        saved = self._saved("advice")
+        if saved is not None:
+            self.outputs["advice"] = saved
+            return UpdateJournalTemplate(advice=saved, question=ev.question)
+        started = time.perf_counter()
+        advice = await advise(ev.profile, ev.principles, ev.book_chunks, ev.question, verbose=self.verbose)
+        self._record("advice", started, advice)
         return UpdateJournalTemplate(advice=advice, question=ev.question)
 
+    async def _existing_template(self) -> str:
+        if self.pipelined:
+            return await asyncio.wrap_future(self._template)
+        return get_workflow_state(self.uuid).read_template()
+
     @step
     async def update_journal_template(self, ctx: Context, ev: UpdateJournalTemplate) -> StopEvent:
         # Step 4: Update the journal template based on the advice provided
+        started = time.perf_counter()
         state = get_workflow_state(self.uuid)
-        existing_template = state.read_template()
-        template_update_agent = get_template_update_agent(existing_template)
-        chat_history = [
-            ChatMessage(
-                role="assistant",
-                content=ev.advice
-            )
-        ]
-        updated_template = await _run_agent(template_update_agent, question=ev.question, chat_history=chat_history,
-                                            verbose=self.verbose)
-        print("Updated template:\n", updated_template.strip("md").strip("```"))
-        print("Do you want to save the updated template? (yes/no)")
-        user_input = input(">>")
+        updated_template = self._saved("update_journal_template")
+        if updated_template is not None:
+            self.outputs["update_journal_template"] = updated_template
+        else:
+            updated_template = await patch_or_regenerate_template(await self._existing_template(), ev.advice,
+                                                                  ev.question, verbose=self.verbose)
+            self._record("update_journal_template", started, updated_template)
+        if self.headless:
+            return StopEvent(result=updated_template)
+        channel = get_user_channel()
+        await channel.say("Updated template:\n" + updated_template.strip("md").strip("```"))
+        await channel.say("Do you want to save the updated template? (yes/no)")
+        user_input = await channel.ask(">>")
         if user_input == "y" or user_input == "yes" or user_input == "Yes" or user_input == "YES" or user_input == "Y":
             state.update_template(updated_template)
-            print("Updated template saved.")
+            await channel.say("Updated template saved.")
         return StopEvent(result=updated_template)
-
-
-async def _verbose_print(handler: WorkflowHandler) -> str:
-    # provide verbose output
-    result = None
-    current_agent = None
-    async for event in handler.stream_events():
-        if (
-                hasattr(event, "current_agent_name")
-                and event.current_agent_name != current_agent
-        ):
-            current_agent = event.current_agent_name
-            print(f"\n{'=' * 50}")
-            print(f"🤖 Agent: {current_agent}")
-            print(f"{'=' * 50}\n")
-        elif isinstance(event, AgentOutput):
-            if event.response.content:
-                print("📤 Output:", event.response.content)
-                result = event.response.content
-            if event.tool_calls:
-                print(
-                    "🛠️  Planning to use tools:",
-                    [call.tool_name for call in event.tool_calls],
-                )
-        elif isinstance(event, ToolCallResult):
-            print(f"🔧 Tool Result ({event.tool_name}):")
-            print(f"  Arguments: {event.tool_kwargs}")
-            print(f"  Output: {event.tool_output}")
-        elif isinstance(event, ToolCall):
-            print(f"🔨 Calling Tool: {event.tool_name}")
-            print(f"  With arguments: {event.tool_kwargs}")
-        elif isinstance(event, StopEvent):
-            print(f"🔧 Stop Event: {event}")
-            result = str(event.result)
-    return result
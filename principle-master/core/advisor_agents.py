@@ -1,5 +1,7 @@
 import asyncio
-from typing import List
+import threading
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
 
 from llama_index.core import VectorStoreIndex, get_response_synthesizer
 from llama_index.core.agent.workflow import FunctionAgent
@@ -8,7 +10,10 @@ from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.response_synthesizers import ResponseMode
 from llama_index.core.tools import FunctionTool
 
-from core.index import load_persisted_index
+from core.common import run_agent
+from core.context_packer import ContextPacker, DEFAULT_TOKEN_BUDGET, book_chunk_items
+from core.index import get_cached_index, get_personal_index, PERSONAL_TOP_K
+from utils.user_channel import get_user_channel
 
 DYNAMIC_AGENT_ADJUSTMENT_PROMPT = "You should handover to {next_agent_name} when you are done. "
 
@@ -22,15 +27,33 @@ You should not attempt to answer the question but return summarised content as y
 """
 
 
+# Agents, tools and query engines without per-request state are built once per process and reused.
+_AGENT_POOL = {}
+_AGENT_POOL_LOCK = threading.Lock()
+
+
+def _pooled(key, build: Callable):
+    with _AGENT_POOL_LOCK:
+        if key in _AGENT_POOL:
+            return _AGENT_POOL[key]
+    built = build()
+    with _AGENT_POOL_LOCK:
+        return _AGENT_POOL.setdefault(key, built)
+
+
 def get_interviewer_agent(is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
+    key = ("interviewer", is_dynamic_agent, tuple(can_handoff_to or ()))
+    return _pooled(key, lambda: _build_interviewer_agent(is_dynamic_agent, can_handoff_to))
+
+
+def _build_interviewer_agent(is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
     async def clarification(user_original_message, questions_raised: List[str]) -> str:
-        # sleep here because I am lazy to implement a io lock, wait for verbose log to finish first.
-        await asyncio.sleep(0.5)
+        channel = get_user_channel()
         result = ""
         for q in questions_raised:
             result += q + ":"
-            print("Question:" + q)
-            response = input("Response:")
+            await channel.say("Question:" + q)
+            response = await channel.ask("Response:")
             result += response + "\n"
         return result
 
@@ -110,28 +133,68 @@ Example rewrites:
 """
 
 
+def get_principle_query_engine() -> RetrieverQueryEngine:
+    return _pooled("query_engine", lambda: _create_query_engine_from_index(get_cached_index()))
+
+
+def retrieve_book_chunks(query_engine: RetrieverQueryEngine, statements: List[str]) -> List[Tuple[str, float]]:
+    """
+    :return: The retrieved book nodes as (content, similarity score), a node found by several statements once
+    with its best score.
+    """
+    chunks = []
+    for q in statements:
+        response = query_engine.query(q)
+        chunks.extend((n.get_content(), n.score or 0.0) for n in response.source_nodes)
+    return merge_book_chunks(chunks)
+
+
+def merge_book_chunks(*chunk_lists: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    scores = {}
+    for chunks in chunk_lists:
+        for content, score in chunks:
+            scores[content] = max(scores.get(content, 0.0), score or 0.0)
+    return list(scores.items())
+
+
+# book nodes retrieved by the pooled RAG agent's tool, collected per run so they can be packed with their scores
+_collected_book_chunks: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("collected_book_chunks",
+                                                                                   default=None)
+
+
+def collect_book_chunks() -> List[Tuple[str, float]]:
+    """
+    Collect the book nodes the RAG agent retrieves in the current task into the returned list.
+    """
+    chunks = []
+    _collected_book_chunks.set(chunks)
+    return chunks
+
+
 def get_principle_rag_agent(is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
-    index = load_persisted_index()
-    query_engine = _create_query_engine_from_index(index)
+    key = ("reference_retriever", is_dynamic_agent, tuple(can_handoff_to or ()))
+    return _pooled(key, lambda: _build_principle_rag_agent(is_dynamic_agent, can_handoff_to))
+
+
+def _build_principle_rag_agent(is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
+    query_engine = get_principle_query_engine()
 
     async def look_up_principle_book(original_question: str, rewrote_statement: List[str]) -> List[str]:
-        result = []
-        for q in rewrote_statement:
-            response = query_engine.query(q)
-            content = [n.get_content() for n in response.source_nodes]
-            result.extend(content)
-        return result
+        chunks = await asyncio.to_thread(retrieve_book_chunks, query_engine, rewrote_statement)
+        collected = _collected_book_chunks.get()
+        if collected is not None:
+            collected.extend(chunks)
+        return [content for content, _ in chunks]
 
     async def clarify_question(original_question: str, your_questions_to_user: List[str]) -> str:
         """
         Clarify the user's question if needed. Ask follow-up questions to ensure you understand the user's intent.
         """
-        # sleep here because I am lazy to implement a io lock, wait for verbose log to finish first.
-        await asyncio.sleep(0.5)
+        channel = get_user_channel()
         response = ""
         for q in your_questions_to_user:
-            print(f"Question: {q}")
-            r = input("Response:")
+            await channel.say(f"Question: {q}")
+            r = await channel.ask("Response:")
             response += f"Question: {q}\nResponse: {r}\n"
         return response
 
@@ -161,6 +224,21 @@ def get_principle_rag_agent(is_dynamic_agent: bool = False, can_handoff_to: List
     return agent
 
 
+def get_personal_history_tool() -> FunctionTool:
+    return _pooled("recall_personal_history", _build_personal_history_tool)
+
+
+def _build_personal_history_tool() -> FunctionTool:
+    async def recall_personal_history(query: str) -> List[str]:
+        return await asyncio.to_thread(get_personal_index().retrieve, query, PERSONAL_TOP_K)
+
+    return FunctionTool.from_defaults(
+        fn=recall_personal_history,
+        name="recall_personal_history",
+        description="Look up the user's own past reflection cases, principles and journal entries most relevant to the query.",
+    )
+
+
 BOOK_CONTENT_PROMPT = """
 Book Content: 
 ```
@@ -196,20 +274,25 @@ User's principle:
 """
 
 
-def get_adviser_agent(user_profile: dict, user_principles: List[str], book_content: str = None,
-                      is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
+def get_adviser_agent(user_profile: dict, user_principles: List[str], book_chunks: List[Tuple[str, float]] = None,
+                      is_dynamic_agent: bool = False, can_handoff_to: List[str] = None,
+                      question: str = None, token_budget: int = DEFAULT_TOKEN_BUDGET):
+    book_items = book_chunk_items(book_chunks) if not is_dynamic_agent else []
+    packed = ContextPacker(token_budget).pack(book_items, user_principles, user_profile, question=question)
     if not is_dynamic_agent:
-        book_content = BOOK_CONTENT_PROMPT.format(book_content=book_content)
+        book_content = BOOK_CONTENT_PROMPT.format(book_content=packed.book_content())
     else:
         book_content = ""
     agent = FunctionAgent(
         name="principle_advisor",
         description="You are a helpful advisor which will advise user's question based on the some guidance from Principle book by Ray Dalio and user's own principles.\n",
         system_prompt=ADVISER_PROMPT.format(
-            user_principles="\n".join(user_principles),
-            user_profile="\n".join([k + ": " + v for (k, v) in user_profile.items()]),
+            user_principles="\n".join(packed.principles),
+            user_profile="\n".join([k + ": " + v for (k, v) in packed.profile.items()]),
             book_content=book_content,
-        ))
+        ),
+        tools=[get_personal_history_tool()] if is_dynamic_agent else [],
+    )
     if is_dynamic_agent and can_handoff_to is not None:
         agent.can_handoff_to = can_handoff_to
         agent.system_prompt = agent.system_prompt + DYNAMIC_AGENT_ADJUSTMENT_PROMPT.format(
@@ -217,6 +300,26 @@ def get_adviser_agent(user_profile: dict, user_principles: List[str], book_conte
     return agent
 
 
+def retrieve_references(query_engine: Optional[RetrieverQueryEngine], text: str) \
+        -> Tuple[List[Tuple[str, float]], List[str]]:
+    """
+    :param query_engine: The book query engine, None when no book has been indexed.
+    :return: The scored book chunks and the user's cases and journals closest to the text.
+    """
+    book_chunks = [] if query_engine is None else retrieve_book_chunks(query_engine, [text])
+    principles = get_personal_index().retrieve(text)
+    return book_chunks, principles
+
+
+async def advise(profile: dict, principles: List[str], book_chunks: List[Tuple[str, float]], question: str,
+                 verbose: bool = False) -> str:
+    """
+    Ask the adviser agent for advice on the question, grounded in the retrieved references.
+    """
+    advisor = get_adviser_agent(profile, principles, book_chunks, question=question)
+    return await run_agent(advisor, question=question, verbose=verbose)
+
+
 def get_template_update_agent(existing_template: str, is_dynamic_agent: bool = False, can_handoff_to: List[str] = None):
     template_update_prompt = """
 You are an AI assistant that updates a daily journal template based on:
@@ -247,3 +350,12 @@ Existing Template:
         agent.system_prompt = agent.system_prompt + DYNAMIC_AGENT_ADJUSTMENT_PROMPT.format(
             next_agent_name=can_handoff_to[0])
     return agent
+
+
+def warm_agent_pool():
+    """
+    Build the pooled agents and tools of the static advice flow ahead of the first request.
+    """
+    get_interviewer_agent()
+    get_principle_rag_agent()
+    get_personal_history_tool()
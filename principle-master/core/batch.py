@@ -0,0 +1,112 @@
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+import tiktoken
+from llama_index.core import Settings
+from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
+from rich import print
+
+from core.advice_agent_flow import AdviceWorkFlow
+from core.advisor_agents import warm_agent_pool
+from core.context_packer import ENCODING_MODEL
+from core.user_context import set_current_user
+from utils.llm import get_embedding, get_llm
+from utils.user_channel import ScriptedChannel, set_user_channel
+
+DEFAULT_CONCURRENCY = 4
+
+
+def load_questions(path: str) -> List[dict]:
+    questions = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                questions.append(json.loads(line))
+    return questions
+
+
+async def _advise(item: dict, semaphore: asyncio.Semaphore, pipelined: bool) -> dict:
+    clarifications = item.get("clarifications") or []
+    if isinstance(clarifications, str):
+        clarifications = [clarifications]
+    result = {"user_id": item.get("user_id"), "question": item["question"]}
+    async with semaphore:
+        # runs in its own task, the interviewer's questions are answered from the given clarifications and the
+        # profile and personal history are the given user's
+        set_user_channel(ScriptedChannel(clarifications))
+        started = time.perf_counter()
+        workflow = None
+        try:
+            set_current_user(None if item.get("user_id") is None else str(item["user_id"]))
+            workflow = AdviceWorkFlow(session_id=str(item.get("user_id")), pipelined=pipelined, headless=True)
+            await workflow.run(user_msg=item["question"])
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency"] = time.perf_counter() - started
+    if workflow is None:
+        result["stage_latency"] = {}
+        return result
+    result["clarified_question"] = workflow.outputs.get("interview")
+    result["advice"] = workflow.outputs.get("advice")
+    result["template"] = workflow.outputs.get("update_journal_template")
+    result["stage_latency"] = workflow.stage_latency
+    return result
+
+
+def _stage_report(results: List[dict]) -> Dict[str, dict]:
+    stages = {}
+    for r in results:
+        for stage, latency in r["stage_latency"].items():
+            stages.setdefault(stage, []).append(latency)
+    return {stage: {"mean": statistics.mean(v), "p50": statistics.median(v), "max": max(v)}
+            for stage, v in stages.items()}
+
+
+async def run_batch_advice(input_path: str, output_path: str, concurrency: int = DEFAULT_CONCURRENCY,
+                           pipelined: bool = False) -> dict:
+    """
+    Run the static advice flow headlessly for every question of a JSONL file of
+    {user_id, question, clarifications} and write one JSONL result per question. Every question is answered
+    from the profile and personal history of its user, or of the local user when user_id is not given.
+    :return: Throughput, per-stage latency and token usage of the batch.
+    """
+    Settings.llm = get_llm()
+    Settings.embed_model = get_embedding()
+    token_counter = TokenCountingHandler(tokenizer=tiktoken.encoding_for_model(ENCODING_MODEL).encode)
+    Settings.callback_manager = CallbackManager([token_counter])
+    # load the book index and agents once for the whole batch
+    await asyncio.to_thread(warm_agent_pool)
+
+    questions = load_questions(input_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    results = []
+    with open(output_path, "w") as out:
+        for future in asyncio.as_completed([_advise(q, semaphore, pipelined) for q in questions]):
+            result = await future
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            results.append(result)
+    elapsed = time.perf_counter() - started
+
+    failed = [r for r in results if "error" in r]
+    report = {
+        "questions": len(results),
+        "failed": len(failed),
+        "elapsed_seconds": elapsed,
+        "questions_per_minute": len(results) / elapsed * 60 if elapsed > 0 else 0.0,
+        "stage_latency": _stage_report(results),
+        "prompt_tokens": token_counter.prompt_llm_token_count,
+        "completion_tokens": token_counter.completion_llm_token_count,
+        "embedding_tokens": token_counter.total_embedding_token_count,
+    }
+    print(f"Processed {report['questions']} questions ({report['failed']} failed) in {elapsed:.1f}s, "
+          f"{report['questions_per_minute']:.2f} questions/min")
+    for stage, latency in report["stage_latency"].items():
+        print(f"  {stage}: mean {latency['mean']:.2f}s, p50 {latency['p50']:.2f}s, max {latency['max']:.2f}s")
+    print(f"Tokens: prompt {report['prompt_tokens']}, completion {report['completion_tokens']}, "
+          f"embedding {report['embedding_tokens']}")
+    return report
@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from typing import Dict, List, Tuple
+
+from utils.file_lock import FileLock
+
+
+def _append(path: str, data: bytes) -> int:
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        offset = os.lseek(fd, 0, os.SEEK_END)
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return offset
+
+
+def _disk_usage(path: str) -> int:
+    try:
+        return os.stat(path).st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of compressed blobs, appended to a single pack file under <store_dir>/blobs/. An
+    index file holds one "<sha256> <offset> <length> <codec>" line per blob, so identical content is written once
+    no matter how many records reference it, and small blobs do not take a file system block each.
+    Blobs written by earlier versions as blobs/<2-char prefix>/<sha256>.gz files are still read.
+    """
+    BLOB_DIR = "blobs"
+    PACK_FILE = "blobs.pack"
+    INDEX_FILE = "blobs.idx"
+    LOCK_FILE = "blobs.lock"
+    LEGACY_SUFFIX = ".gz"
+    ZLIB = "z"
+    RAW = "r"
+
+    def __init__(self, store_dir: str):
+        self.blob_dir = os.path.join(store_dir, self.BLOB_DIR)
+        self._lock = FileLock(os.path.join(self.blob_dir, self.LOCK_FILE))
+        self._entries: Dict[str, Tuple[int, int, str]] = {}
+        self._index_size = 0
+
+    @property
+    def pack_file(self):
+        return os.path.join(self.blob_dir, self.PACK_FILE)
+
+    @property
+    def index_file(self):
+        return os.path.join(self.blob_dir, self.INDEX_FILE)
+
+    def _legacy_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest + self.LEGACY_SUFFIX)
+
+    def _refresh(self):
+        """
+        Read the index lines appended since the last refresh, by this or another process, truncating a torn last
+        line. Called with the lock held.
+        """
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, "rb+") as f:
+            f.seek(self._index_size)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    # torn line from an interrupted append, its blob is written again when put next time
+                    f.truncate(offset)
+                    break
+                digest, blob_offset, length, codec = line.decode("utf8").split()
+                self._entries[digest] = (int(blob_offset), int(length), codec)
+            self._index_size = f.tell()
+
+    def put_many(self, blobs: List[bytes]) -> List[str]:
+        """
+        Store the blobs missing from the store with one append to the pack file and one to its index.
+        :return: The digest of every blob.
+        """
+        digests = [hashlib.sha256(data).hexdigest() for data in blobs]
+        with self._lock:
+            self._refresh()
+            payloads = []
+            entries = []
+            pending = set()
+            for digest, data in zip(digests, blobs):
+                if digest in self._entries or digest in pending or os.path.exists(self._legacy_path(digest)):
+                    continue
+                pending.add(digest)
+                compressed = zlib.compress(data)
+                # short messages do not compress, they are stored as they are
+                codec, payload = (self.ZLIB, compressed) if len(compressed) < len(data) else (self.RAW, data)
+                payloads.append(payload)
+                entries.append((digest, len(payload), codec))
+            if not payloads:
+                return digests
+            offset = _append(self.pack_file, b"".join(payloads))
+            lines = []
+            for digest, length, codec in entries:
+                lines.append(f"{digest} {offset} {length} {codec}\n")
+                self._entries[digest] = (offset, length, codec)
+                offset += length
+            # the index goes last: blobs missing from it are unreferenced and rewritten on the next put
+            _append(self.index_file, "".join(lines).encode("utf8"))
+            self._index_size = os.path.getsize(self.index_file)
+        return digests
+
+    def put(self, data: bytes) -> str:
+        return self.put_many([data])[0]
+
+    def get(self, digest: str) -> bytes:
+        entry = self._entries.get(digest)
+        if entry is None:
+            with self._lock:
+                self._refresh()
+                entry = self._entries.get(digest)
+        if entry is None:
+            with open(self._legacy_path(digest), "rb") as f:
+                return gzip.decompress(f.read())
+        offset, length, codec = entry
+        with open(self.pack_file, "rb") as f:
+            f.seek(offset)
+            payload = f.read(length)
+        return zlib.decompress(payload) if codec == self.ZLIB else payload
+
+    def disk_usage(self) -> int:
+        """
+        :return: The bytes allocated on disk for the store, including blobs written by earlier versions.
+        """
+        usage = 0
+        for root, _, files in os.walk(self.blob_dir):
+            for file in files:
+                usage += _disk_usage(os.path.join(root, file))
+        return usage
+
+
+_BLOB_STORES: Dict[str, BlobStore] = {}
+_BLOB_STORES_LOCK = threading.Lock()
+
+
+def get_blob_store(store_dir: str) -> BlobStore:
+    with _BLOB_STORES_LOCK:
+        if store_dir not in _BLOB_STORES:
+            _BLOB_STORES[store_dir] = BlobStore(store_dir)
+        return _BLOB_STORES[store_dir]
+
+
+def put_dialog(blob_store: BlobStore, dialog: List[str]) -> List[str]:
+    return blob_store.put_many([m.encode("utf8") for m in dialog])
+
+
+def build_dialog_storage_report(blob_store: BlobStore, cases: List[dict]) -> Dict[str, int]:
+    """
+    Compare the size the dialogs would take stored inline with the disk space the blob store takes. Disk use is
+    counted in allocated blocks, as a small file takes a whole block however few bytes it holds.
+    """
+    report = {"cases": 0, "messages": 0, "unique_messages": 0, "inline_bytes": 0}
+    sizes = {}
+    for case in cases:
+        refs = case.get("dialog_refs")
+        if not refs:
+            continue
+        report["cases"] += 1
+        for h in refs:
+            if h not in sizes:
+                sizes[h] = len(blob_store.get(h))
+            report["inline_bytes"] += sizes[h]
+            report["messages"] += 1
+    report["unique_messages"] = len(sizes)
+    report["stored_bytes"] = blob_store.disk_usage()
+    report["saved_bytes"] = report["inline_bytes"] - report["stored_bytes"]
+    return report
@@ -0,0 +1,333 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from utils.file_lock import FileLock
+
+
+class CaseLog(object):
+    """
+    Append-only JSONL log of reflection cases. Every case is one line, appended and fsync-ed, so saving a case
+    does not depend on how many cases were stored before. An offset index (one "case_id offset" line per
+    append) allows fetching a case by id without reading the log. Superseded records are removed by a
+    background compaction once they make up a large enough share of the log.
+    A projection file keeps only the principle and summary of every case, so those can be listed without
+    parsing the stored dialogs.
+    Other processes (CLI, MCP server, nightly job) share the log, so every access holds a lock file. The cached
+    offsets are checked against the log's inode and size before use: records appended elsewhere are scanned
+    in, and the cache is rebuilt when the log was replaced by another process's compaction.
+    """
+    LOG_FILE = "cases.jsonl"
+    LOCK_FILE = "cases.lock"
+    INDEX_FILE = "cases.idx"
+    PROJECTION_FILE = "principles.jsonl"
+    PROJECTION_FIELDS = ("case_id", "session_id", "summary", "new_principle")
+    LEGACY_FILE = "cases.json"
+    IMPORTED_SUFFIX = ".imported"
+    COMPACTION_MIN_RECORDS = 64
+    COMPACTION_RATIO = 0.5
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self._lock = FileLock(os.path.join(store_dir, self.LOCK_FILE))
+        self._offsets: Optional[Dict[str, int]] = None
+        self._log_stamp: Optional[Tuple[int, int]] = None
+        self._records = 0
+        self._compaction: Optional[threading.Thread] = None
+
+    @property
+    def log_file(self):
+        return os.path.join(self.store_dir, self.LOG_FILE)
+
+    @property
+    def index_file(self):
+        return os.path.join(self.store_dir, self.INDEX_FILE)
+
+    @property
+    def projection_file(self):
+        return os.path.join(self.store_dir, self.PROJECTION_FILE)
+
+    @property
+    def legacy_file(self):
+        return os.path.join(self.store_dir, self.LEGACY_FILE)
+
+    @staticmethod
+    def _encode(case: dict) -> bytes:
+        return (json.dumps(case, sort_keys=True) + "\n").encode("utf8")
+
+    @classmethod
+    def _project(cls, case: dict) -> dict:
+        return {k: case.get(k) for k in cls.PROJECTION_FIELDS}
+
+    @staticmethod
+    def _append(path: str, data: bytes) -> int:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            offset = os.lseek(fd, 0, os.SEEK_END)
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return offset
+
+    @staticmethod
+    def _stamp(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size
+
+    def _fsync_dir(self):
+        fd = os.open(self.store_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_index(self, offsets: Dict[str, int]):
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w") as f:
+            for case_id, offset in offsets.items():
+                f.write(f"{case_id} {offset}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_file)
+
+    def _write_projection(self, projections: List[dict]):
+        tmp = self.projection_file + ".tmp"
+        with open(tmp, "wb") as f:
+            for p in projections:
+                f.write(self._encode(p))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.projection_file)
+
+    def _projection_intact(self) -> bool:
+        if not os.path.exists(self.projection_file):
+            return False
+        size = os.path.getsize(self.projection_file)
+        if size == 0:
+            return True
+        with open(self.projection_file, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    def _read_projection(self) -> List[dict]:
+        if not os.path.exists(self.projection_file):
+            return []
+        projections = {}
+        with open(self.projection_file, "rb") as f:
+            for line in f:
+                p = json.loads(line)
+                # a re-stored case moves to the position of its latest record, as in load_all
+                projections.pop(p["case_id"], None)
+                projections[p["case_id"]] = p
+        return list(projections.values())
+
+    def _import_legacy(self):
+        with open(self.legacy_file, "r") as f:
+            cases = json.load(f)
+        tmp = self.log_file + ".tmp"
+        with open(tmp, "wb") as f:
+            for case in cases:
+                f.write(self._encode(case))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.log_file)
+        os.replace(self.legacy_file, self.legacy_file + self.IMPORTED_SUFFIX)
+        self._fsync_dir()
+
+    def _scan_log(self, offsets: Dict[str, int], start: int) -> int:
+        """
+        Add the offsets of the records from start to the end of the log, truncating a torn last record.
+        :return: The number of records scanned.
+        """
+        records = 0
+        with open(self.log_file, "rb+") as f:
+            f.seek(start)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    # torn record from an interrupted append
+                    f.truncate(offset)
+                    break
+                offsets[json.loads(line)["case_id"]] = offset
+                records += 1
+        return records
+
+    def _ensure_loaded(self):
+        if self._offsets is not None:
+            stamp = self._stamp(self.log_file)
+            if stamp == self._log_stamp:
+                return
+            if stamp is not None and self._log_stamp is not None and stamp[0] == self._log_stamp[0] \
+                    and stamp[1] > self._log_stamp[1]:
+                # another process appended, its index and projection lines are already written
+                self._records += self._scan_log(self._offsets, self._log_stamp[1])
+                self._log_stamp = self._stamp(self.log_file)
+                return
+            self._offsets = None
+        os.makedirs(self.store_dir, exist_ok=True)
+        if not os.path.exists(self.log_file) and os.path.exists(self.legacy_file):
+            self._import_legacy()
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)
+        offsets = {}
+        records = 0
+        recovered = False
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # torn index line from an interrupted append, the log scan below recovers it
+                        recovered = True
+                        continue
+                    case_id, offset = line.split()
+                    offsets[case_id] = int(offset)
+                    records += 1
+        if os.path.exists(self.log_file):
+            start = 0
+            if offsets:
+                with open(self.log_file, "rb") as f:
+                    f.seek(max(offsets.values()))
+                    f.readline()
+                    start = f.tell()
+            scanned = self._scan_log(offsets, start)
+            records += scanned
+            recovered = recovered or scanned > 0
+        if recovered:
+            self._write_index(offsets)
+        self._offsets = offsets
+        self._records = records
+        self._log_stamp = self._stamp(self.log_file)
+        if os.path.exists(self.log_file) and (recovered or not self._projection_intact()):
+            self._write_projection([self._project(c) for c in self.load_all()])
+
+    def append(self, case: dict):
+        data = self._encode(case)
+        with self._lock:
+            self._ensure_loaded()
+            offset = self._append(self.log_file, data)
+            # the index line goes last: a record missing from the index is recovered by the log scan, which
+            # also rebuilds the projection
+            self._append(self.projection_file, self._encode(self._project(case)))
+            self._append(self.index_file, f"{case['case_id']} {offset}\n".encode("utf8"))
+            self._offsets[case["case_id"]] = offset
+            self._records += 1
+            self._log_stamp = self._stamp(self.log_file)
+            self._maybe_compact()
+
+    def get(self, case_id: str) -> Optional[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            offset = self._offsets.get(case_id)
+            if offset is None:
+                return None
+            with open(self.log_file, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline())
+
+    def load_all(self) -> List[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            if not os.path.exists(self.log_file):
+                return []
+            live = set(self._offsets.values())
+            cases = []
+            with open(self.log_file, "rb") as f:
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    if offset in live:
+                        cases.append(json.loads(line))
+            return cases
+
+    def load_projections(self) -> List[dict]:
+        """
+        Load case_id, session_id, summary and new_principle of every case without reading the log.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return self._read_projection()
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._records < self.COMPACTION_MIN_RECORDS:
+                return
+            if (self._records - len(self._offsets)) / self._records < self.COMPACTION_RATIO:
+                return
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            self._compaction = threading.Thread(target=self.compact, daemon=True)
+            self._compaction.start()
+
+    def compact(self):
+        """
+        Rewrite the log keeping only the latest record of every case. Live records are copied without holding
+        the lock; records appended meanwhile are copied under the lock before the log is swapped. Nothing is
+        swapped if another process compacted the log in between.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if not os.path.exists(self.log_file):
+                return
+            live = sorted(self._offsets.items(), key=lambda x: x[1])
+            inode, end = self._log_stamp
+        fd, tmp = tempfile.mkstemp(dir=self.store_dir, prefix=self.LOG_FILE + ".", suffix=".compact")
+        try:
+            offsets = {}
+            records = 0
+            with os.fdopen(fd, "wb") as dst, open(self.log_file, "rb") as src:
+                if os.fstat(src.fileno()).st_ino != inode:
+                    return
+                for case_id, offset in live:
+                    src.seek(offset)
+                    offsets[case_id] = dst.tell()
+                    dst.write(src.readline())
+                    records += 1
+            with self._lock:
+                stamp = self._stamp(self.log_file)
+                if stamp is None or stamp[0] != inode:
+                    return
+                self._ensure_loaded()
+                with open(self.log_file, "rb") as src, open(tmp, "ab") as dst:
+                    src.seek(end)
+                    for line in src:
+                        offsets[json.loads(line)["case_id"]] = dst.tell()
+                        dst.write(line)
+                        records += 1
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    os.fchmod(dst.fileno(), os.stat(self.log_file).st_mode & 0o777)
+                os.replace(tmp, self.log_file)
+                self._write_index(offsets)
+                self._write_projection(self._read_projection())
+                self._fsync_dir()
+                self._offsets = offsets
+                self._records = records
+                self._log_stamp = self._stamp(self.log_file)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+_CASE_LOGS: Dict[str, CaseLog] = {}
+_CASE_LOGS_LOCK = threading.Lock()
+
+
+def get_case_log(store_dir: str) -> CaseLog:
+    with _CASE_LOGS_LOCK:
+        if store_dir not in _CASE_LOGS:
+            _CASE_LOGS[store_dir] = CaseLog(store_dir)
+        return _CASE_LOGS[store_dir]
@@ -1,27 +1,34 @@
+import asyncio
 import hashlib
 from typing import Optional
 
 from llama_index.core.memory import BaseMemory
 from llama_index.core.tools import FunctionTool
 
-from core.common import MyAgentRunner
+from core.advisor_agents import get_personal_history_tool
+from core.checkpoint import SessionCheckpoint, dump_messages
+from core.common import AsyncMyAgentRunner
 from core.state import get_workflow_state, ReflectionCase
+from utils.user_channel import get_user_channel
 
 TOKEN_LIMIT = 40000
 
 
-class CaseReflectionAgent(MyAgentRunner):
+class CaseReflectionAgent(AsyncMyAgentRunner):
     END_OUTPUT = "CaseCollected"
     GREETING = "Let's to a case reflections."
+    CHECKPOINT_KEY = "case_reflection_memory"
 
     def __init__(self, session_id: str, memory: Optional[BaseMemory] = None,
-                 verbose: bool = False) -> None:
+                 verbose: bool = False, checkpoint: Optional[SessionCheckpoint] = None) -> None:
+        self.checkpoint = checkpoint
 
-        def store_reflection_case(case_summary, case_details, principle_applied, detail_analysis,
-                                  new_principle: str) -> str:
+        async def store_reflection_case(case_summary, case_details, principle_applied, detail_analysis,
+                                        new_principle: str) -> str:
             hashed = hashlib.sha256(case_summary.encode()).hexdigest()
             state = get_workflow_state(session_id)
-            state.persist_case(self.session_id,
+            # persisting also embeds the case into the personal index, keep it off the event loop
+            await asyncio.to_thread(state.persist_case, self.session_id,
                                ReflectionCase(
                                    case_id=hashed,
                                    summary=case_summary,
@@ -39,7 +46,8 @@ class CaseReflectionAgent(MyAgentRunner):
             name="store_reflection_case",
             description="Store reflection case when the information of the cases is sufficiently clarified."
         )
-        super().__init__(session_id, tools=[store_case], memory=memory, verbose=verbose, max_function_calls=1)
+        super().__init__(session_id, tools=[store_case, get_personal_history_tool()], memory=memory,
+                         verbose=verbose, max_function_calls=2)
 
     @staticmethod
     def get_purpose():
@@ -47,7 +55,8 @@ class CaseReflectionAgent(MyAgentRunner):
             "You are an assistant to help user to do a case reflection for practising the instruction in Ray Dalio's Principle.\n"
             "You should ask follow-up questions iteratively until you gather enough clear and structured information about the case.\n"
             "Be sympathetic and patient. Acknowledge and echo the user's feelings based on the information shared.\n"
-            "You may also consult relevant content from the principles book to formulate better and more insightful questions.\n\n"
+            "You may also consult relevant content from the principles book to formulate better and more insightful questions.\n"
+            "You may call recall_personal_history to look up the user's similar past cases and journals.\n\n"
             "A good case reflection should ideally include the following elements:\n"
             "- [Required] Case at hand: Describe what happened.\n"
             "- [Optional] 'One of those': Identify the high-level category this case falls into.\n"
@@ -67,12 +76,15 @@ class CaseReflectionAgent(MyAgentRunner):
         )
         return p
 
-    def _my_chat(self, msg: str) -> str:
+    async def _my_achat(self, msg: str) -> str:
+        channel = get_user_channel()
         user_input = msg
         while True:
             if user_input != "":
-                response = super().chat(user_input)
+                response = await self.achat(user_input)
+                if self.checkpoint is not None:
+                    self.checkpoint.save(self.CHECKPOINT_KEY, dump_messages(self.memory.get_all()))
                 if self.END_OUTPUT in response.response:
                     return self.END_OUTPUT
-                self.print(response.response)
-            user_input = input(">>")
+                await self.say(response.response)
+            user_input = await channel.ask(">>")
@@ -0,0 +1,80 @@
+import json
+import os
+from typing import List
+
+from llama_index.core.base.llms.types import ChatMessage
+
+from core.sqlite_store import get_sqlite_store
+from core.user_context import user_state_dir
+
+
+def _local_store_dir():
+    return user_state_dir()
+
+
+class UnknownSessionError(Exception):
+    pass
+
+
+class SessionCheckpoint(object):
+    """
+    Completed step outputs of one session, saved after every step so that a crashed or interrupted run can be
+    resumed without calling the LLM again. Checkpoints live in the SQLite store when it is enabled, otherwise in
+    notes/checkpoints/<session_id>.json.
+    """
+    CHECKPOINT_DIR = "checkpoints"
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # bound to the directory of the user the session was created for
+        self._dir = _local_store_dir()
+        self._store = get_sqlite_store(self._dir)
+        self._data = self._load()
+
+    def _file(self):
+        return os.path.join(self._dir, self.CHECKPOINT_DIR, f"{self.session_id}.json")
+
+    def _load(self) -> dict:
+        if self._store is not None:
+            return self._store.load_checkpoint(self.session_id) or {}
+        if not os.path.exists(self._file()):
+            return {}
+        with open(self._file(), "r") as f:
+            return json.load(f)
+
+    def _persist(self):
+        if self._store is not None:
+            self._store.save_checkpoint(self.session_id, self._data)
+            return
+        os.makedirs(os.path.dirname(self._file()), exist_ok=True)
+        tmp = self._file() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file())
+
+    def exists(self) -> bool:
+        return len(self._data) > 0
+
+    def get(self, key: str, default=None):
+        return self._data.get(key, default)
+
+    def save(self, key: str, value):
+        self._data[key] = value
+        self._persist()
+
+    def clear(self):
+        self._data = {}
+        if self._store is not None:
+            self._store.delete_checkpoint(self.session_id)
+        elif os.path.exists(self._file()):
+            os.remove(self._file())
+
+
+def dump_messages(messages: List[ChatMessage]) -> List[str]:
+    return [m.model_dump_json() for m in messages]
+
+
+def load_messages(messages: List[str]) -> List[ChatMessage]:
+    return [ChatMessage.model_validate_json(m) for m in messages]
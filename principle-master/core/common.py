@@ -2,9 +2,14 @@ from typing import List, Optional
 
 from llama_index.core import Settings
 from llama_index.core.agent import AgentRunner, FunctionCallingAgentWorker
+from llama_index.core.agent.workflow import AgentOutput, FunctionAgent, ToolCall, ToolCallResult
 from llama_index.core.base.llms.types import ChatMessage
 from llama_index.core.memory import BaseMemory, ChatMemoryBuffer
 from llama_index.core.tools import BaseTool
+from llama_index.core.workflow import StopEvent
+from llama_index.core.workflow.handler import WorkflowHandler
+
+from utils.user_channel import get_user_channel
 
 
 TOKEN_LIMIT = 40000
@@ -39,4 +44,66 @@ class MyAgentRunner(AgentRunner):
         return self._my_chat(msg)
 
     def _my_chat(self, msg: str):
-        raise Exception("Not Implemented")
\ No newline at end of file
+        raise Exception("Not Implemented")
+
+
+class AsyncMyAgentRunner(MyAgentRunner):
+    """
+    MyAgentRunner driven with achat/arun_step and the user channel, so LLM round-trips and user input do not
+    block the event loop.
+    """
+
+    async def say(self, msg):
+        await get_user_channel().say(self.PRINT_FORMAT.format(message=msg))
+
+    async def astart_chat(self, msg: str = None):
+        return await self._my_achat(msg)
+
+    async def _my_achat(self, msg: str):
+        raise Exception("Not Implemented")
+
+
+async def run_agent(agent: FunctionAgent, question, chat_history: Optional[List[ChatMessage]] = None,
+                    verbose: bool = False) -> str:
+    chat_history = [] if chat_history is None else chat_history.copy()
+    chat_history.append(
+        ChatMessage(
+            role="user", content=question,
+        ))
+    handler = agent.run(chat_history=chat_history)
+    if verbose:
+        result = await _verbose_print(handler)
+        return result
+    output = await handler
+    return output.response.content
+
+
+async def _verbose_print(handler: WorkflowHandler) -> str:
+    # provide verbose output
+    channel = get_user_channel()
+    result = None
+    current_agent = None
+    async for event in handler.stream_events():
+        if (
+                hasattr(event, "current_agent_name")
+                and event.current_agent_name != current_agent
+        ):
+            current_agent = event.current_agent_name
+            await channel.say(f"\n{'=' * 50}\n🤖 Agent: {current_agent}\n{'=' * 50}\n")
+        elif isinstance(event, AgentOutput):
+            if event.response.content:
+                await channel.say(f"📤 Output: {event.response.content}")
+                result = event.response.content
+            if event.tool_calls:
+                await channel.say(f"🛠️  Planning to use tools: {[call.tool_name for call in event.tool_calls]}")
+        elif isinstance(event, ToolCallResult):
+            await channel.say(f"🔧 Tool Result ({event.tool_name}):\n"
+                              f"  Arguments: {event.tool_kwargs}\n"
+                              f"  Output: {event.tool_output}")
+        elif isinstance(event, ToolCall):
+            await channel.say(f"🔨 Calling Tool: {event.tool_name}\n"
+                              f"  With arguments: {event.tool_kwargs}")
+        elif isinstance(event, StopEvent):
+            await channel.say(f"🔧 Stop Event: {event}")
+            result = str(event.result)
+    return result
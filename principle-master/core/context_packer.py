@@ -0,0 +1,141 @@
+import logging
+import re
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+ENCODING_MODEL = "gpt-4o-mini"
+DEFAULT_TOKEN_BUDGET = 6000
+# Passages sharing at least this fraction of their word shingles with a kept passage are treated as duplicates.
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+# token counts and shingles of this many distinct passages are kept, so principles are measured once per process
+MEASURE_CACHE_SIZE = 4096
+
+BOOK_CHUNK = "book_chunk"
+PRINCIPLE = "principle"
+PROFILE = "profile"
+
+_ENCODER = None
+
+
+def _get_encoder():
+    global _ENCODER
+    if _ENCODER is None:
+        _ENCODER = tiktoken.encoding_for_model(ENCODING_MODEL)
+    return _ENCODER
+
+
+def count_tokens(text: str) -> int:
+    return len(_get_encoder().encode(text))
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _shingles(text: str) -> FrozenSet[str]:
+    words = _words(text)
+    if len(words) < SHINGLE_SIZE:
+        return frozenset({" ".join(words)} if words else ())
+    return frozenset(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+
+@lru_cache(maxsize=MEASURE_CACHE_SIZE)
+def _measure(text: str) -> Tuple[int, FrozenSet[str]]:
+    return count_tokens(text), _shingles(text)
+
+
+def _relevance(question: Optional[str], text: str) -> float:
+    if not question:
+        return 0.0
+    q = set(_words(question))
+    t = set(_words(text))
+    if not q or not t:
+        return 0.0
+    return len(q & t) / len(q | t)
+
+
+class ContextItem(object):
+    def __init__(self, kind: str, text: str, score: float = 0.0, key: Optional[str] = None):
+        self.kind = kind
+        self.text = text
+        self.score = score
+        self.key = key
+        self.tokens, self.shingles = _measure(text)
+
+
+class PackedContext(object):
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self.used_tokens = 0
+        self.book_chunks: List[str] = []
+        self.principles: List[str] = []
+        self.profile: dict = {}
+        self.dropped: List[ContextItem] = []
+
+    def book_content(self) -> str:
+        return "\n\n".join(self.book_chunks)
+
+
+def book_chunk_items(book_chunks: Optional[List[Tuple[str, float]]]) -> List[ContextItem]:
+    """
+    :param book_chunks: Retrieved book nodes as (content, similarity score).
+    """
+    return [ContextItem(BOOK_CHUNK, text, score=score or 0.0) for text, score in book_chunks or [] if text.strip()]
+
+
+class ContextPacker(object):
+    """
+    Pack adviser context into a token budget. Book chunks are kept first (highest score first), then the
+    principles most relevant to the question, then the profile fields. Overlapping passages are kept once.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def pack(self, book_chunks: List[ContextItem], principles: List[str], profile: dict,
+             question: Optional[str] = None) -> PackedContext:
+        packed = PackedContext(self.token_budget)
+        kept_shingles: List[FrozenSet[str]] = []
+
+        count = len(principles)
+        # most recent principle wins a tie on relevance
+        principle_items = [ContextItem(PRINCIPLE, p, score=_relevance(question, p) + (i + 1) / (count + 1) * 1e-3)
+                           for i, p in enumerate(principles) if p]
+        profile_items = [ContextItem(PROFILE, f"{k}: {v}", key=k) for (k, v) in profile.items() if v]
+
+        for group in (book_chunks, principle_items, profile_items):
+            for item in sorted(group, key=lambda x: x.score, reverse=True):
+                if self._is_duplicate(item, kept_shingles):
+                    packed.dropped.append(item)
+                    logger.info("Dropped duplicate %s: %.60s", item.kind, item.text)
+                    continue
+                if packed.used_tokens + item.tokens > self.token_budget:
+                    packed.dropped.append(item)
+                    logger.info("Dropped %s (%d tokens) over budget %d: %.60s", item.kind, item.tokens,
+                                self.token_budget, item.text)
+                    continue
+                packed.used_tokens += item.tokens
+                kept_shingles.append(item.shingles)
+                if item.kind == BOOK_CHUNK:
+                    packed.book_chunks.append(item.text)
+                elif item.kind == PRINCIPLE:
+                    packed.principles.append(item.text)
+                else:
+                    packed.profile[item.key] = profile[item.key]
+        logger.info("Packed adviser context: %d/%d tokens used, %d items dropped", packed.used_tokens,
+                    self.token_budget, len(packed.dropped))
+        return packed
+
+    @staticmethod
+    def _is_duplicate(item: ContextItem, kept_shingles: List[FrozenSet[str]]) -> bool:
+        if not item.shingles:
+            return False
+        for kept in kept_shingles:
+            if len(item.shingles & kept) / len(item.shingles) >= DUPLICATE_THRESHOLD:
+                return True
+        return False
@@ -1,7 +1,22 @@
+import atexit
+import json
+import logging
 import os
+import threading
+from typing import List, Optional, Tuple
 
 import pymupdf
-from llama_index.core import Document, VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core import Document, Settings, VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.indices.vector_store import VectorIndexRetriever
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+
+from core.user_context import as_user, get_current_user, user_dir
+from utils.atomic_file import atomic_write
+from utils.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
 
 
 def get_local_index_store_dir():
@@ -30,4 +45,350 @@ def load_persisted_index():
     local_index_store = get_local_index_store_dir()
     storage_context = StorageContext.from_defaults(persist_dir=local_index_store)
     index = load_index_from_storage(storage_context)
-    return index
\ No newline at end of file
+    return index
+
+
+_CACHED_INDEX = None
+_CACHED_INDEX_LOCK = threading.Lock()
+
+
+def get_cached_index():
+    """
+    Load the persisted book index once per process and share it between all query engines.
+    """
+    global _CACHED_INDEX
+    with _CACHED_INDEX_LOCK:
+        if _CACHED_INDEX is None:
+            _CACHED_INDEX = load_persisted_index()
+        return _CACHED_INDEX
+
+
+def search_book(query: str, top_k: int) -> List[NodeWithScore]:
+    """
+    Retrieve the book chunks closest to the query from the process-wide book index, with their scores.
+    """
+    retriever = VectorIndexRetriever(index=get_cached_index(), similarity_top_k=top_k)
+    return retriever.retrieve(query)
+
+
+PERSONAL_TOP_K = 3
+
+
+def get_personal_index_store_dir():
+    index_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "./personal_index")
+    return user_dir(index_dir)
+
+
+def _case_to_document(case: dict) -> Document:
+    text = (f"Case: {case.get('summary', '')}\n"
+            f"Detail: {case.get('detail', '')}\n"
+            f"Principle applied: {case.get('principle_applied', '')}\n"
+            f"Analysis: {case.get('detail_analysis', '')}\n"
+            f"New principle: {case.get('new_principle', '')}")
+    return Document(id_=f"case-{case['case_id']}", text=text,
+                    metadata={"type": "case", "case_id": case["case_id"]})
+
+
+def _embed_documents(documents: List[Document]) -> List[BaseNode]:
+    """
+    Split and embed the documents apart from any index, so no lock is held while the embedding API is called.
+    """
+    if not documents:
+        return []
+    nodes = run_transformations(documents, Settings.transformations)
+    embeddings = Settings.embed_model.get_text_embedding_batch(
+        [n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes])
+    for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding
+    return nodes
+
+
+class PersonalIndex(object):
+    """
+    Vector index over the user's own reflection cases and journals. Persisted cases are queued and indexed by a
+    background worker in batches, with one persist per batch, so saving a case never waits for the embedding
+    API. Cases missing from the index, e.g. after a failed batch, are indexed when it is loaded. Lookups that may
+    return journals ask the same worker to re-index the journals modified since the last sync, they do not wait
+    for it. Documents are embedded before the index is locked, lookups only wait for the embedded nodes to be
+    inserted. Every user has their own index, built from their own cases and journals.
+    The CLI, the MCP server and the nightly job share the persisted index. Changes are made under a lock file on
+    the latest persisted copy, and the in-memory copy is reloaded whenever another process persisted since.
+    """
+    MANIFEST_FILE = "journal_manifest.json"
+    DOCSTORE_FILE = "docstore.json"
+    LOCK_FILE = ".lock"
+    # seconds to wait at exit for queued cases to be indexed
+    FLUSH_TIMEOUT = 30
+
+    def __init__(self, user_id: Optional[str] = None):
+        self.user_id = user_id
+        with as_user(user_id):
+            self.store_dir = get_personal_index_store_dir()
+        self._index = None
+        self._index_stamp = None
+        self._lock = threading.RLock()
+        # taken after _lock, held while the persisted index is read or changed
+        self._file_lock = FileLock(os.path.join(self.store_dir, self.LOCK_FILE))
+        self._pending: List[dict] = []
+        self._journals_stale = False
+        self._indexing = False
+        self._pending_cond = threading.Condition()
+        self._worker = None
+
+    def _manifest_file(self):
+        return os.path.join(self.store_dir, self.MANIFEST_FILE)
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self._manifest_file()):
+            return {}
+        with open(self._manifest_file(), "r") as f:
+            return json.load(f)
+
+    def _stamp(self) -> Tuple:
+        """
+        :return: The stat of the persisted docstore and journal manifest, which every persist rewrites.
+        """
+        stamp = []
+        for file in (os.path.join(self.store_dir, self.DOCSTORE_FILE), self._manifest_file()):
+            try:
+                st = os.stat(file)
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _persist(self, manifest: dict = None):
+        with self._file_lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._index.storage_context.persist(persist_dir=self.store_dir)
+            if manifest is not None:
+                # journal changes are checked without the lock, the manifest must never be seen half written
+                atomic_write(self._manifest_file(), json.dumps(manifest, indent=4, sort_keys=True))
+            self._index_stamp = self._stamp()
+
+    def _load(self) -> VectorStoreIndex:
+        """
+        :return: The in-memory index, reloaded first if another process persisted a newer one.
+        """
+        if self._index is not None and self._stamp() == self._index_stamp:
+            return self._index
+        with self._file_lock:
+            self._index = None
+            stamp = self._stamp()
+            if os.path.exists(os.path.join(self.store_dir, self.DOCSTORE_FILE)):
+                storage_context = StorageContext.from_defaults(persist_dir=self.store_dir)
+                self._index = load_index_from_storage(storage_context)
+                self._index_stamp = stamp
+                self._index_missing_cases()
+                return self._index
+            # first use: backfill from the cases stored so far
+            from core.state import CaseManager
+            with as_user(self.user_id):
+                documents = [_case_to_document(c) for c in CaseManager().load_cases()]
+            self._index = VectorStoreIndex.from_documents(documents)
+            self._persist()
+            return self._index
+
+    def _index_missing_cases(self):
+        from core.state import CaseManager
+        case_manager = CaseManager()
+        indexed = set(self._index.ref_doc_info.keys())
+        with as_user(self.user_id):
+            summaries = case_manager.load_case_summaries()
+        missing = [c["case_id"] for c in summaries if f"case-{c['case_id']}" not in indexed]
+        if not missing:
+            return
+        try:
+            with as_user(self.user_id):
+                cases = [case_manager.load_case(case_id) for case_id in missing]
+            self._index.refresh_ref_docs([_case_to_document(c) for c in cases if c is not None])
+            self._persist()
+        except Exception:
+            logger.exception("Failed to index %d missing cases, retrying on the next load", len(missing))
+            self._index = None
+            raise
+
+    def add_case(self, case: dict):
+        """
+        Queue the case to be indexed by the background worker.
+        """
+        with self._pending_cond:
+            self._pending.append(case)
+            self._start_worker()
+
+    def request_journal_sync(self):
+        """
+        Have the background worker re-index the journals modified since the last sync.
+        """
+        with self._pending_cond:
+            self._journals_stale = True
+            self._start_worker()
+
+    def _start_worker(self):
+        # called with _pending_cond held
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._index_pending, name="personal-index", daemon=True)
+            self._worker.start()
+            atexit.register(self.flush, self.FLUSH_TIMEOUT)
+        self._pending_cond.notify_all()
+
+    def _index_pending(self):
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait_for(lambda: self._pending or self._journals_stale)
+                cases, self._pending = self._pending, []
+                sync, self._journals_stale = self._journals_stale, False
+                self._indexing = True
+            try:
+                if cases:
+                    self._index_cases(cases)
+                if sync:
+                    try:
+                        self.sync_journals(self._journal_dir())
+                    except Exception:
+                        # the next lookup requests another sync
+                        logger.exception("Failed to sync the journals")
+            finally:
+                with self._pending_cond:
+                    self._indexing = False
+                    self._pending_cond.notify_all()
+
+    def _index_cases(self, cases: List[dict]):
+        try:
+            documents = [_case_to_document(c) for c in cases]
+            nodes = _embed_documents(documents)
+            with self._lock, self._file_lock:
+                self._insert(self._load(), documents, nodes)
+                self._persist()
+        except Exception:
+            # drop the partly updated copy, the cases are indexed as missing on the next load
+            logger.exception("Failed to index %d cases", len(cases))
+            with self._lock:
+                self._index = None
+
+    @staticmethod
+    def _insert(index: VectorStoreIndex, documents: List[Document], nodes: List[BaseNode],
+                removed: Optional[List[str]] = None):
+        """
+        Replace the documents, and remove the removed ones, with the already embedded nodes of the documents.
+        """
+        indexed = set(index.ref_doc_info.keys())
+        for ref_doc_id in (removed or []) + [d.get_doc_id() for d in documents]:
+            if ref_doc_id in indexed:
+                index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+        index.insert_nodes(nodes)
+        for document in documents:
+            index.docstore.set_document_hash(document.get_doc_id(), document.hash)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the queued cases and requested journal sync are indexed.
+        :return: False if they are still being indexed after the timeout.
+        """
+        with self._pending_cond:
+            return self._pending_cond.wait_for(
+                lambda: not self._pending and not self._journals_stale and not self._indexing, timeout)
+
+    def sync_journals(self, journal_dir: str) -> int:
+        """
+        Re-index journals created or modified since the last sync and drop deleted ones. The journals are embedded
+        before the index is locked.
+        :return: The number of journals re-indexed.
+        """
+        has_changes, _, changed, _ = self._journal_changes(journal_dir)
+        if not has_changes:
+            return 0
+        mtimes = {}
+        documents = []
+        for file in changed:
+            path = os.path.join(journal_dir, file)
+            try:
+                # taken before reading, a journal written meanwhile is re-indexed by the next sync
+                mtimes[file] = os.path.getmtime(path)
+                with open(path, "r") as f:
+                    documents.append(Document(id_=f"journal-{file}", text=f.read(),
+                                              metadata={"type": "journal", "file": file}))
+            except FileNotFoundError:
+                continue
+        nodes = _embed_documents(documents)
+        with self._lock, self._file_lock:
+            try:
+                index = self._load()
+                # another process may have indexed some of the changes meanwhile
+                manifest = self._load_manifest()
+                documents = [d for d in documents if manifest.get(d.metadata["file"]) != mtimes[d.metadata["file"]]]
+                fresh = {d.get_doc_id() for d in documents}
+                nodes = [n for n in nodes if n.ref_doc_id in fresh]
+                removed = [f for f in manifest if not os.path.exists(os.path.join(journal_dir, f))]
+                if not documents and not removed:
+                    return 0
+                self._insert(index, documents, nodes, [f"journal-{f}" for f in removed])
+                for file in removed:
+                    manifest.pop(file)
+                for document in documents:
+                    manifest[document.metadata["file"]] = mtimes[document.metadata["file"]]
+                self._persist(manifest)
+                return len(documents)
+            except Exception:
+                # drop the partly updated copy, the persisted one is reloaded
+                self._index = None
+                raise
+
+    def _journal_changes(self, journal_dir: str) -> Tuple[bool, dict, List[str], List[str]]:
+        """
+        :return: Whether any journal changed since the last sync, the mtime of every journal, and the changed and
+            removed journal files.
+        """
+        manifest = self._load_manifest()
+        current = {}
+        if os.path.exists(journal_dir):
+            for file in os.listdir(journal_dir):
+                if file.startswith("journal-") and file.endswith(".md"):
+                    current[file] = os.path.getmtime(os.path.join(journal_dir, file))
+        changed = [f for f, mtime in current.items() if manifest.get(f) != mtime]
+        removed = [f for f in manifest if f not in current]
+        return bool(changed or removed), current, changed, removed
+
+    def _journal_dir(self) -> str:
+        from core.state import JournalManager
+        with as_user(self.user_id):
+            return JournalManager.local_journal_dir()
+
+    def warm(self):
+        self.sync_journals(self._journal_dir())
+
+    def retrieve(self, query: str, top_k: int = PERSONAL_TOP_K) -> List[str]:
+        return [n.get_content() for n in self.search(query, top_k)]
+
+    def search(self, query: str, top_k: int = PERSONAL_TOP_K, doc_type: Optional[str] = None) -> List[NodeWithScore]:
+        """
+        :param doc_type: Only return "case" or "journal" documents, both if not given.
+        :return: The closest cases and journals with their scores.
+        """
+        if doc_type != "case":
+            # journals modified since the last sync are indexed in the background, the lookup does not wait
+            self.request_journal_sync()
+        with self._lock:
+            index = self._load()
+            if len(index.docstore.docs) == 0:
+                return []
+            filters = None if doc_type is None else MetadataFilters(filters=[ExactMatchFilter(key="type",
+                                                                                              value=doc_type)])
+            retriever = VectorIndexRetriever(index=index, similarity_top_k=top_k, filters=filters)
+            return retriever.retrieve(query)
+
+
+_PERSONAL_INDEXES = {}
+_PERSONAL_INDEXES_LOCK = threading.Lock()
+
+
+def get_personal_index() -> PersonalIndex:
+    """
+    :return: The personal index of the current user.
+    """
+    user_id = get_current_user()
+    with _PERSONAL_INDEXES_LOCK:
+        if user_id not in _PERSONAL_INDEXES:
+            _PERSONAL_INDEXES[user_id] = PersonalIndex(user_id)
+        return _PERSONAL_INDEXES[user_id]
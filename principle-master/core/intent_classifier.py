@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core import Settings
+
+from core.state import ADVISE, CASE_REFLECTION, ENDING, JOURNAL, RECORD_PROFILE, Function
+from core.user_context import base_state_dir
+
+logger = logging.getLogger(__name__)
+
+# a nearest example has to be this similar, and this much closer than the best other function, to skip the LLM
+SIMILARITY_THRESHOLD = 0.82
+SIMILARITY_MARGIN = 0.04
+
+# rules only match whole commands ("write my journal", "update my profile") or the bare function name, so a
+# question that merely mentions a keyword ("should I keep a journal?") is left to the examples and the LLM
+_LEAD = r"^\s*(please\s+|(can|could) you\s+|i('d| would) like to\s+|i (want|need) to\s+|i wanna\s+|let me\s+|let'?s\s+)*"
+KEYWORD_RULES: Dict[Function, List[str]] = {
+    ENDING: [r"^\s*(bye|goodbye|quit|exit|stop|nothing|no thanks?|that'?s all|i'?m done)\W*$"],
+    JOURNAL: [
+        r"^\s*journal\W*$",
+        _LEAD + r"(start|write|open|create|begin)\s+(my\s+|a\s+(new\s+)?|the\s+|today'?s\s+)?(daily\s+)?"
+                r"(journal|diary)(\s+entry)?(\s+(for\s+)?today)?\W*$",
+    ],
+    RECORD_PROFILE: [
+        r"^\s*record\s*profile\W*$",
+        _LEAD + r"(update|edit|record|change|fill in|set up)\s+(my\s+)?(profile|mbti)\b.*$",
+    ],
+    CASE_REFLECTION: [
+        r"^\s*case\s*reflection\W*$",
+        _LEAD + r"(reflect on|(do|start) a (case )?reflection)\b.*$",
+    ],
+    ADVISE: [
+        r"^\s*advi[cs]e\W*$",
+        _LEAD + r"(get\s+|have\s+)?(some\s+)?advice\s+(on|about|for|with)\b.*$",
+        r"^\s*(i need|give me)\s+(some\s+)?advice\b.*$",
+        r"^\s*help me (decide|choose)\b.*$",
+    ],
+}
+
+EXAMPLES: Dict[Function, List[str]] = {
+    ENDING: [
+        "I want to finish the chat",
+        "Nothing else, thank you",
+        "Let's stop here",
+        "I am done for today",
+    ],
+    JOURNAL: [
+        "I want to write today's journal",
+        "Let me write down what happened today",
+        "Open my daily notes",
+        "I would like to record my day",
+    ],
+    RECORD_PROFILE: [
+        "I want to update my personal information",
+        "Let me tell you about my strengths and weaknesses",
+        "I want to record my values and personality type",
+        "Update my one big challenge",
+    ],
+    CASE_REFLECTION: [
+        "Something went wrong at work and I want to learn from it",
+        "I want to look back at a mistake I made",
+        "Help me analyse what happened in a painful situation",
+        "I would like to review a case and come up with a new principle",
+    ],
+    ADVISE: [
+        "I have a problem and don't know how to handle it",
+        "Should I take the new job offer?",
+        "I need help with a decision",
+        "How should I deal with a conflict with my manager?",
+    ],
+}
+
+
+def get_intent_cache_file():
+    return os.path.join(base_state_dir(), "intent_examples.json")
+
+
+def _cosine(a: List[float], norm_a: float, b: List[float], norm_b: float) -> float:
+    if norm_a == 0 or norm_b == 0:
+        return 0.0
+    return sum(x * y for x, y in zip(a, b)) / (norm_a * norm_b)
+
+
+def _norm(v: List[float]) -> float:
+    return math.sqrt(sum(x * x for x in v))
+
+
+class IntentClassifier(object):
+    """
+    Route clear-cut user input without an LLM round-trip. Keyword rules are tried first, then the nearest
+    example utterance by embedding similarity. Returns None when neither is confident, so the caller can fall
+    back to IntentionDetectionAgent. Example embeddings are cached on disk per embedding model.
+    """
+
+    def __init__(self, examples: Optional[Dict[Function, List[str]]] = None,
+                 rules: Optional[Dict[Function, List[str]]] = None):
+        self.examples = EXAMPLES if examples is None else examples
+        self.rules = {function: [re.compile(p, re.IGNORECASE) for p in patterns]
+                      for function, patterns in (KEYWORD_RULES if rules is None else rules).items()}
+        self._vectors: Optional[List[Tuple[Function, List[float], float]]] = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.total = 0
+
+    def _cache_key(self) -> str:
+        model = Settings.embed_model
+        name = f"{type(model).__name__}:{getattr(model, 'model_name', '')}"
+        return hashlib.sha256((name + json.dumps(self.examples, sort_keys=True)).encode()).hexdigest()
+
+    def _load_vectors(self) -> List[Tuple[Function, List[float], float]]:
+        key = self._cache_key()
+        cache_file = get_intent_cache_file()
+        embeddings = None
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                embeddings = cached["embeddings"]
+        if embeddings is None:
+            embeddings = {function: Settings.embed_model.get_text_embedding_batch(texts)
+                          for function, texts in self.examples.items()}
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump({"key": key, "embeddings": embeddings}, f)
+        return [(function, v, _norm(v)) for function, vectors in embeddings.items() for v in vectors]
+
+    def warm(self):
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = self._load_vectors()
+
+    def match_rules(self, text: str) -> Optional[Function]:
+        matched = {function for function, patterns in self.rules.items() if any(p.search(text) for p in patterns)}
+        return matched.pop() if len(matched) == 1 else None
+
+    def match_examples(self, text: str) -> Optional[Function]:
+        self.warm()
+        query = Settings.embed_model.get_query_embedding(text)
+        query_norm = _norm(query)
+        best: Dict[Function, float] = {}
+        for function, vector, norm in self._vectors:
+            best[function] = max(best.get(function, -1.0), _cosine(query, query_norm, vector, norm))
+        ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)
+        if not ranked or ranked[0][1] < SIMILARITY_THRESHOLD:
+            return None
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < SIMILARITY_MARGIN:
+            return None
+        return ranked[0][0]
+
+    def classify(self, text: str) -> Optional[Function]:
+        """
+        :param text: The user's message.
+        :return: The function to route to, or None when the LLM should decide.
+        """
+        function = self.match_rules(text)
+        if function is None:
+            try:
+                function = self.match_examples(text)
+            except Exception as e:
+                logger.warning("Intent example matching failed, falling back to the LLM: %s", e)
+        # classify runs on worker threads
+        with self._stats_lock:
+            self.total += 1
+            if function is not None:
+                self.hits += 1
+            hits, total = self.hits, self.total
+        logger.info("Intent fast path %s, hit rate %d/%d (%.0f%%)", "hit" if function else "miss", hits, total,
+                    100.0 * hits / total)
+        return function
+
+
+_INTENT_CLASSIFIER: Optional[IntentClassifier] = None
+_INTENT_CLASSIFIER_LOCK = threading.Lock()
+
+
+def get_intent_classifier() -> IntentClassifier:
+    global _INTENT_CLASSIFIER
+    with _INTENT_CLASSIFIER_LOCK:
+        if _INTENT_CLASSIFIER is None:
+            _INTENT_CLASSIFIER = IntentClassifier()
+        return _INTENT_CLASSIFIER
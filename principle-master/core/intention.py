@@ -1,8 +1,14 @@
-from core.common import MyAgentRunner
+import asyncio
+
+from llama_index.core.base.llms.types import ChatMessage
+
+from core.common import AsyncMyAgentRunner
+from core.intent_classifier import get_intent_classifier
 from core.state import AVAILABLE_FUNCTIONS, ROUTING, ENDING, get_workflow_state
+from utils.user_channel import get_user_channel
 
 
-class IntentionDetectionAgent(MyAgentRunner):
+class IntentionDetectionAgent(AsyncMyAgentRunner):
     ALL_STAGES = set(AVAILABLE_FUNCTIONS).union({ROUTING, ENDING})
     GREETING = "I am a principle practice helper which provide case reflection, make-a-plan, and advises function"
 
@@ -18,13 +24,20 @@ class IntentionDetectionAgent(MyAgentRunner):
             "**If user indicate they wanna finish chatting, output 'Ending'. ")
         return p
 
-    def _my_chat(self, msg: str) -> str:
+    async def _my_achat(self, msg: str) -> str:
+        channel = get_user_channel()
         while True:
-            user_input = input(">>")
+            user_input = await channel.ask(">>")
             if user_input == "":
                 continue
-            response = super().chat(user_input)
+            function = await asyncio.to_thread(get_intent_classifier().classify, user_input)
+            if function is not None:
+                # keep the exchange in memory as if the agent had answered it
+                self.memory.put(ChatMessage(role="user", content=user_input))
+                self.memory.put(ChatMessage(role="assistant", content=function))
+                return function
+            response = await self.achat(user_input)
             stripped = response.response.strip()
             if stripped in self.ALL_STAGES:
                 return stripped
-            self.print(stripped)
+            await self.say(stripped)
@@ -0,0 +1,104 @@
+import bisect
+import os
+import re
+import threading
+from typing import List, Optional
+
+JOURNAL_FILE = re.compile(r"^journal-(\d{4}-\d{2}-\d{2})\.md$")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class JournalPage(object):
+    def __init__(self, dates: List[str], total: int, next_cursor: Optional[str]):
+        self.dates = dates
+        self.total = total
+        self.next_cursor = next_cursor
+
+    def to_dict(self):
+        return {"dates": self.dates, "total": self.total, "next_cursor": self.next_cursor}
+
+
+class JournalIndex(object):
+    """
+    Sorted in-memory index of journal dates. The journal directory is only rescanned when its mtime changes,
+    and journals written through the server are added directly. Date-range queries are answered by bisection.
+    `version` is bumped whenever the set of dates changes.
+    """
+
+    def __init__(self, journal_dir: str):
+        self.journal_dir = journal_dir
+        self._dates: List[str] = []
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def _scan(self) -> List[str]:
+        dates = []
+        for file in os.listdir(self.journal_dir):
+            match = JOURNAL_FILE.match(file)
+            if match:
+                dates.append(match.group(1))
+        return dates
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.journal_dir).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                if self._dates:
+                    self.version += 1
+                self._dates, self._mtime = [], None
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            scanned = set(self._scan())
+            current = set(self._dates)
+            added, removed = scanned - current, current - scanned
+            if removed or len(added) > len(current):
+                self._dates = sorted(scanned)
+            else:
+                for date in added:
+                    bisect.insort(self._dates, date)
+            if added or removed:
+                self.version += 1
+            self._mtime = mtime
+
+    def add(self, date: str):
+        with self._lock:
+            i = bisect.bisect_left(self._dates, date)
+            if i == len(self._dates) or self._dates[i] != date:
+                self._dates.insert(i, date)
+                self.version += 1
+
+    def _range(self, start: Optional[str], end: Optional[str]):
+        lo = 0 if start is None else bisect.bisect_left(self._dates, start)
+        hi = len(self._dates) if end is None else bisect.bisect_right(self._dates, end)
+        return lo, max(lo, hi)
+
+    def count(self, start: Optional[str] = None, end: Optional[str] = None) -> int:
+        self.refresh()
+        with self._lock:
+            lo, hi = self._range(start, end)
+            return hi - lo
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None, cursor: Optional[str] = None,
+              limit: Optional[int] = None) -> JournalPage:
+        """
+        :param start: First date to include, YYYY-MM-DD.
+        :param end: Last date to include, YYYY-MM-DD.
+        :param cursor: next_cursor of the previous page, the page starts after this date.
+        :param limit: Page size, all dates in range if not given.
+        :return: The page of dates in ascending order, the number of dates in range and the next cursor.
+        """
+        self.refresh()
+        with self._lock:
+            lo, hi = self._range(start, end)
+            total = hi - lo
+            if cursor is not None:
+                lo = max(lo, bisect.bisect_right(self._dates, cursor))
+            limit = hi - lo if limit is None else min(max(limit, 1), MAX_PAGE_SIZE)
+            dates = self._dates[lo:min(hi, lo + limit)]
+            next_cursor = dates[-1] if dates and lo + limit < hi else None
+            return JournalPage(dates, total, next_cursor)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from llama_index.core import Settings
+from rich import print
+
+from core.advisor_agents import advise, get_principle_query_engine, retrieve_references
+from core.index import get_local_index_store_dir
+from core.state import CaseManager, JournalManager, ProfileManager
+from core.template_patch import patch_or_regenerate_template
+from core.user_context import as_user, base_state_dir, list_users, user_state_dir
+from utils.llm import get_embedding, get_llm
+
+RECENT_JOURNALS = 3
+# runs before this hour are the night before the journal day, e.g. a 03:00 cron job precomputes for today
+NEXT_DAY_FROM_HOUR = 12
+# journals are cut to this length so a long entry does not crowd out the others
+MAX_JOURNAL_CHARS = 4000
+
+
+def get_precompute_manifest_file():
+    return os.path.join(user_state_dir(), "precompute_manifest.json")
+
+
+def _load_manifest() -> dict:
+    manifest_file = get_precompute_manifest_file()
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: dict):
+    manifest_file = get_precompute_manifest_file()
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    tmp = manifest_file + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_file)
+
+
+def _recent_journals(journal_manager: JournalManager, recent: int) -> List[Tuple[str, str, float]]:
+    journals = []
+    for date in journal_manager.list_journal_dates()[-recent:]:
+        journal_file = os.path.join(journal_manager.local_journal_dir(), f"journal-{date}.md")
+        if not os.path.exists(journal_file):
+            continue
+        with open(journal_file, "r") as f:
+            journals.append((date, f.read()[:MAX_JOURNAL_CHARS], os.path.getmtime(journal_file)))
+    return journals
+
+
+def _build_question(date: str, journals: List[Tuple[str, str, float]], cases: List[dict]) -> str:
+    question = f"Based on my recent journals and reflections, what should I focus on {date}?\n"
+    for date, content, _ in journals:
+        question += f"\nJournal of {date}:\n{content}\n"
+    for case in cases:
+        question += f"\nNew reflection: {case.get('summary')}\nNew principle: {case.get('new_principle')}\n"
+    return question
+
+
+def _query_engine():
+    return get_principle_query_engine() if os.path.exists(get_local_index_store_dir()) else None
+
+
+async def precompute_journal_template(date: str, recent: int = RECENT_JOURNALS, force: bool = False) -> Optional[dict]:
+    """
+    Precompute the advice and journal template of the given date for the current user, from their latest journals
+    and the cases they reflected since the last run. Nothing is done when neither changed, unless forced.
+    :return: The date, advice and path of the precomputed template, or None when skipped.
+    """
+    journal_manager = JournalManager()
+    manifest = _load_manifest()
+    journals = _recent_journals(journal_manager, recent)
+    seen_cases = set(manifest.get("case_ids", []))
+    summaries = CaseManager().load_case_summaries()
+    new_cases = [c for c in summaries if c["case_id"] not in seen_cases]
+    journal_marks = [[date, mtime] for date, _, mtime in journals]
+    up_to_date = journal_marks == manifest.get("journals") and not new_cases
+    if not force and up_to_date and os.path.exists(journal_manager.precomputed_template_file(date)):
+        return None
+
+    question = _build_question(date, journals, new_cases)
+    book_chunks, principles = await asyncio.to_thread(retrieve_references, _query_engine(), question)
+    advice = await advise(ProfileManager().load_profile(), principles, book_chunks, question)
+    template = await patch_or_regenerate_template(journal_manager.read_template(), advice, question)
+    template_file = journal_manager.save_precomputed_template(date, template)
+    _save_manifest({
+        "journals": journal_marks,
+        "case_ids": [c["case_id"] for c in summaries],
+        "last_date": date,
+        "advice": advice,
+    })
+    return {"date": date, "advice": advice, "template_file": template_file}
+
+
+def default_precompute_date(now: Optional[datetime] = None) -> str:
+    """
+    :return: The date of the next journal: today when run after midnight and before noon, tomorrow otherwise.
+    """
+    now = datetime.now() if now is None else now
+    if now.hour >= NEXT_DAY_FROM_HOUR:
+        now += timedelta(days=1)
+    return now.strftime("%Y-%m-%d")
+
+
+async def run_precompute(date: Optional[str] = None, recent: int = RECENT_JOURNALS, force: bool = False):
+    """
+    Entry point of the nightly job, precomputes the template of the next journal unless a date is given, for the
+    local user and every user of the server. Templates of past dates are removed first.
+    """
+    Settings.llm = get_llm()
+    Settings.embed_model = get_embedding()
+    date = default_precompute_date() if date is None else date
+    today = datetime.today().strftime("%Y-%m-%d")
+    for user_id in list_users(base_state_dir(), JournalManager.base_journal_dir()):
+        name = "local user" if user_id is None else f"user {user_id}"
+        with as_user(user_id):
+            removed = JournalManager().prune_precomputed_templates(today)
+            if removed:
+                print(f"Removed {removed} precomputed templates of past dates for the {name}.")
+            try:
+                result = await precompute_journal_template(date, recent=recent, force=force)
+            except Exception as e:
+                # one user's failure does not hold up the others
+                print(f"Failed to precompute the template for {date} of the {name}: {e}")
+                continue
+        if result is None:
+            print(f"No new journals or cases since the last run, template for {date} of the {name} is up to date.")
+            continue
+        print(f"Precomputed template for {date} of the {name} saved to {result['template_file']}")
+        print(f"Advice:\n{result['advice']}")
@@ -1,7 +1,15 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.base.llms.types import ChatMessage
 from llama_index.core.tools import FunctionTool
 
-from core.common import MyAgentRunner
+from core.checkpoint import SessionCheckpoint
+from core.common import AsyncMyAgentRunner
 from core.state import get_workflow_state, Profile
+from utils.user_channel import get_user_channel
 
 
 def get_user_message(question, answer, formating, evaluation: str):
@@ -14,7 +22,29 @@ def get_user_message(question, answer, formating, evaluation: str):
             f"** If you find the answer met the criteria, you should rewrote it according to formating requirement and update the profile **\n")
 
 
-class ProfileUpdateAgent(MyAgentRunner):
+def get_batch_evaluation_message(question, answer, formating, evaluation: str):
+    return (f"You are helpful assistant to evaluate user's answer to a question whether meet the criteria. \n"
+            f"- Question: {question}\n"
+            f"- Answer: {answer}\n"
+            f"- Formating: {formating}\n"
+            f"- Evaluation: {evaluation}\n"
+            f"Respond with only a JSON object: "
+            f'{{"accepted": true or false, "content": "<the answer rewrote according to formating requirement '
+            f'without losing or adding any information, empty if not accepted>", '
+            f'"feedback": "<how can user answer it properly, empty if accepted>"}}\n')
+
+
+def _parse_evaluation(text: str) -> Tuple[bool, str, str]:
+    text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError:
+        return False, "", "Sorry, I could not evaluate the answer, could you rephrase it?"
+    accepted = bool(result.get("accepted")) and bool(result.get("content"))
+    return accepted, result.get("content") or "", result.get("feedback") or ""
+
+
+class ProfileUpdateAgent(AsyncMyAgentRunner):
     value_candidate = [
         "To be liked/loved",
         "To be ethically good",
@@ -44,8 +74,15 @@ class ProfileUpdateAgent(MyAgentRunner):
             f"You are an assistant to help to analysis user's response and see whether it meet the evaluation criteria and record it with proper format. "
         )
 
-    def __init__(self, session_id: str, verbose: bool = False):
+    CHECKPOINT_KEY = "profile_answered"
+    BATCH_CHECKPOINT_KEY = "profile_batch"
+
+    def __init__(self, session_id: str, verbose: bool = False, checkpoint: Optional[SessionCheckpoint] = None,
+                 batch: bool = False):
         self.question_key = None
+        self.checkpoint = checkpoint
+        self.batch = batch
+        self.state = get_workflow_state(session_id)
         self.questions = [
             ProfileUpdateAgent.Question("mbti", "What is your MBTI?", "Capitalize  strings. e.g. ENTP, INFJ",
                                         "Answer have to be legitimate MBTI type."),
@@ -70,12 +107,11 @@ class ProfileUpdateAgent(MyAgentRunner):
             ProfileUpdateAgent.Question("principles", "Do you have any existing principles you are operating with?",
                                         "Legitimate English sentence", "Answer are clearly express users' principle")
         ]
-        state = get_workflow_state(session_id)
 
         def update_profile(content):
             profile = Profile()
             profile.update(self.question_key, content)
-            state.persist_profile(profile)
+            self.state.persist_profile(profile)
             return "Profile saved"
 
         store_profile = FunctionTool.from_defaults(
@@ -86,24 +122,89 @@ class ProfileUpdateAgent(MyAgentRunner):
 
         super().__init__(session_id, [store_profile], verbose=verbose, max_function_calls=1)
 
-    def _my_chat(self, msg: str):
+    async def _my_achat(self, msg: str):
+        if self.batch:
+            return await self._batch_achat()
+        channel = get_user_channel()
+        # questions answered before an interruption are already saved in the profile
+        answered = [] if self.checkpoint is None else self.checkpoint.get(self.CHECKPOINT_KEY, [])
         for question in self.questions:
+            if question.question_key in answered:
+                continue
             self.question_key = question.question_key
-            print(question.question)
-            self.address_question(question)
+            await channel.say(question.question)
+            await self.address_question(question)
+            if self.checkpoint is not None:
+                answered.append(question.question_key)
+                self.checkpoint.save(self.CHECKPOINT_KEY, answered)
         return "Profile updated"
 
     FINISH_RESPONSE = 'AnswerCollected'
 
-    def address_question(self, question: Question):
-        answer = input(">>")
+    async def address_question(self, question: Question):
+        channel = get_user_channel()
+        answer = await channel.ask(">>")
         user_msg = get_user_message(question.question, answer, question.formating, question.evaluation)
         while True:
             task = self.create_task(user_msg)
-            response = self.run_step(task.task_id)
+            response = await self.arun_step(task.task_id)
             if len(response.output.sources) > 0:
                 # Have triggered function call
                 return response.output.sources[0].content, True
-            print(response.output.response)
-            user_clarification = input("Clarification:")
+            await channel.say(response.output.response)
+            user_clarification = await channel.ask("Clarification:")
             user_msg += f"\nUser Clarification: {user_clarification}"  # Append user clarification to the chat history
+
+    async def _evaluate(self, question: Question, answer: str) -> Tuple[bool, str, str]:
+        messages = [
+            ChatMessage(role="system", content=self.get_purpose()),
+            ChatMessage(role="user", content=get_batch_evaluation_message(question.question, answer,
+                                                                          question.formating, question.evaluation)),
+        ]
+        response = await Settings.llm.achat(messages)
+        return _parse_evaluation(response.message.content or "")
+
+    async def _batch_achat(self) -> str:
+        """
+        Ask all questions up front and evaluate the answers concurrently, one LLM call per answer. Only the
+        answers that fail their evaluation are asked again, and the profile is persisted once at the end.
+        Every answer, clarification and accepted content is checkpointed as it comes in, so a resumed session
+        only asks and evaluates what is left.
+        """
+        channel = get_user_channel()
+        saved = {} if self.checkpoint is None else self.checkpoint.get(self.BATCH_CHECKPOINT_KEY, {})
+        answers: Dict[str, str] = saved.get("answers", {})
+        accepted_content: Dict[str, str] = saved.get("accepted", {})
+
+        def save():
+            if self.checkpoint is not None:
+                self.checkpoint.save(self.BATCH_CHECKPOINT_KEY, {"answers": answers, "accepted": accepted_content})
+
+        for question in self.questions:
+            if question.question_key in answers:
+                continue
+            await channel.say(question.question)
+            answers[question.question_key] = await channel.ask(">>")
+            save()
+        pending: List[ProfileUpdateAgent.Question] = [q for q in self.questions
+                                                      if q.question_key not in accepted_content]
+        while pending:
+            results = await asyncio.gather(*[self._evaluate(q, answers[q.question_key]) for q in pending])
+            failed = []
+            for question, (accepted, content, feedback) in zip(pending, results):
+                if accepted:
+                    accepted_content[question.question_key] = content
+                else:
+                    failed.append((question, feedback))
+            save()
+            for question, feedback in failed:
+                await channel.say(f"{question.question}\n{feedback}")
+                user_clarification = await channel.ask("Clarification:")
+                answers[question.question_key] += f"\nUser Clarification: {user_clarification}"
+                save()
+            pending = [question for question, _ in failed]
+        profile = Profile()
+        for question_key, content in accepted_content.items():
+            profile.update(question_key, content)
+        await asyncio.to_thread(self.state.persist_profile, profile)
+        return "Profile updated"
@@ -0,0 +1,47 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+
+def content_etag(content: str) -> str:
+    return hashlib.sha256(content.encode("utf8")).hexdigest()[:32]
+
+
+class CachedContent(object):
+    def __init__(self, content: str, etag: str, stamp):
+        self.content = content
+        self.etag = etag
+        self.stamp = stamp
+
+
+class FileCache(object):
+    """
+    Contents of small text files cached by (mtime, size). A file is only re-read when its stat changes, and
+    every cached content carries a hash of itself as its ETag.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, CachedContent] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stamp(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read(self, path: str) -> CachedContent:
+        stamp = self.stamp(path)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached.stamp == stamp:
+                return cached
+        with open(path, "r") as f:
+            content = f.read()
+        cached = CachedContent(content, content_etag(content), stamp)
+        with self._lock:
+            self._entries[path] = cached
+        return cached
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from llama_index.core import Settings
+from llama_index.core.memory import ChatMemoryBuffer
+
+from core.checkpoint import SessionCheckpoint
+from core.state import release_workflow_state
+from core.user_context import set_current_user
+from core.workflow import PrincipleMasterFlow
+from utils.llm import get_embedding, get_llm
+from utils.user_channel import SocketChannel, set_user_channel
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = 64
+SESSION_TTL_SECONDS = 30 * 60
+SESSION_TOKEN_LIMIT = 8000
+# longest line a client may send, bounds the memory of every connection's read buffer
+MAX_LINE_BYTES = 64 * 1024
+REAPER_INTERVAL_SECONDS = 30
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session(object):
+    def __init__(self, session_id: str, channel: SocketChannel):
+        self.session_id = session_id
+        self.channel = channel
+        self.task: Optional[asyncio.Task] = None
+        self.checkpoint: Optional[SessionCheckpoint] = None
+        self.last_active = time.monotonic()
+
+
+class SessionChannel(SocketChannel):
+    """
+    Socket channel that marks its session active whenever something is said to or by the user.
+    """
+
+    def __init__(self, registry: "SessionRegistry", session_id: str, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        super().__init__(reader, writer)
+        self.registry = registry
+        self.session_id = session_id
+
+    async def _write(self, msg: str):
+        await super()._write(msg)
+        self.registry.touch(self.session_id)
+
+    async def _read(self, prompt: str) -> str:
+        line = await super()._read(prompt)
+        self.registry.touch(self.session_id)
+        return line
+
+
+class SessionRegistry(object):
+    """
+    Registry of live sessions in least-recently-active order. Sessions idle for longer than the TTL are evicted,
+    and new sessions are refused once max_sessions are active. A released session's checkpoint is deleted, as
+    server sessions can not be resumed.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def admit(self, session: Session):
+        self.evict_expired()
+        if len(self._sessions) >= self.max_sessions:
+            raise SessionLimitError(f"Server is at capacity ({self.max_sessions} sessions), try again later.")
+        self._sessions[session.session_id] = session
+
+    def touch(self, session_id: str):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(session_id)
+
+    def release(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        release_workflow_state(session_id)
+        if session is not None and session.checkpoint is not None:
+            session.checkpoint.clear()
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = []
+        for session_id, session in self._sessions.items():
+            if now - session.last_active < self.ttl_seconds:
+                # sessions are kept in activity order, the rest are fresher
+                break
+            expired.append(session)
+        for session in expired:
+            logger.info("Evicting idle session %s", session.session_id)
+            if session.task is not None:
+                session.task.cancel()
+            self.release(session.session_id)
+        return len(expired)
+
+
+class PrincipleMasterServer(object):
+    """
+    Host many PrincipleMasterFlow sessions in one event loop. Every connection is one session that talks to the
+    user through a line-based socket channel. The user id asked for first selects whose profile, cases, journals
+    and personal index the session works on.
+    """
+
+    def __init__(self, registry: Optional[SessionRegistry] = None, verbose: bool = False,
+                 is_dynamic_advice_flow: bool = False, is_pipelined_advice_flow: bool = False,
+                 session_token_limit: int = SESSION_TOKEN_LIMIT):
+        self.registry = SessionRegistry() if registry is None else registry
+        self.verbose = verbose
+        self.is_dynamic_advice_flow = is_dynamic_advice_flow
+        self.is_pipelined_advice_flow = is_pipelined_advice_flow
+        self.session_token_limit = session_token_limit
+
+    async def _run_session(self, session: Session):
+        # runs in its own task, so the channel and user bindings stay local to this session
+        set_user_channel(session.channel)
+        await self._identify(session)
+        memory = ChatMemoryBuffer.from_defaults(token_limit=self.session_token_limit)
+        workflow = PrincipleMasterFlow(memory=memory, verbose=self.verbose,
+                                       is_dynamic_advice_flow=self.is_dynamic_advice_flow,
+                                       is_pipelined_advice_flow=self.is_pipelined_advice_flow,
+                                       session_id=session.session_id,
+                                       memory_token_limit=self.session_token_limit)
+        session.checkpoint = workflow.checkpoint
+        await workflow.run()
+
+    @staticmethod
+    async def _identify(session: Session):
+        while True:
+            user_id = (await session.channel.ask("User id: ")).strip()
+            try:
+                set_current_user(user_id)
+                return
+            except ValueError as e:
+                await session.channel.say(str(e))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session_id = str(uuid.uuid4())
+        session = Session(session_id, SessionChannel(self.registry, session_id, reader, writer))
+        try:
+            self.registry.admit(session)
+        except SessionLimitError as e:
+            writer.write((str(e) + "\n").encode("utf8"))
+            await writer.drain()
+            writer.close()
+            return
+        logger.info("Session %s started, %d active", session_id, len(self.registry))
+        session.task = asyncio.create_task(self._run_session(session))
+        try:
+            await session.task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error("Session %s failed: %s", session_id, e)
+        finally:
+            self.registry.release(session_id)
+            writer.close()
+            logger.info("Session %s closed, %d active", session_id, len(self.registry))
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+            self.registry.evict_expired()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None):
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket, limit=MAX_LINE_BYTES)
+            logger.info("Serving principle master on %s", unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port, limit=MAX_LINE_BYTES)
+            logger.info("Serving principle master on %s:%d", host, port)
+        reaper = asyncio.create_task(self._reap())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+
+
+async def run_server(host: str, port: int, unix_socket: Optional[str] = None, max_sessions: int = MAX_SESSIONS,
+                     ttl_seconds: float = SESSION_TTL_SECONDS, verbose: bool = False,
+                     is_dynamic_advice_flow: bool = False, is_pipelined_advice_flow: bool = False):
+    logging.basicConfig(level=logging.INFO)
+    Settings.llm = get_llm()
+    Settings.embed_model = get_embedding()
+    server = PrincipleMasterServer(registry=SessionRegistry(max_sessions=max_sessions, ttl_seconds=ttl_seconds),
+                                   verbose=verbose, is_dynamic_advice_flow=is_dynamic_advice_flow,
+                                   is_pipelined_advice_flow=is_pipelined_advice_flow)
+    await server.serve(host=host, port=port, unix_socket=unix_socket)
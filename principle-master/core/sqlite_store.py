@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    summary TEXT,
+    detail TEXT,
+    principle_applied TEXT,
+    detail_analysis TEXT,
+    new_principle TEXT,
+    dialog TEXT,
+    dialog_refs TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cases_session_id ON cases (session_id);
+CREATE INDEX IF NOT EXISTS idx_cases_new_principle ON cases (new_principle);
+CREATE TABLE IF NOT EXISTS journals (
+    file TEXT PRIMARY KEY,
+    date TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_journals_date ON journals (date);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    session_id TEXT PRIMARY KEY,
+    content TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    content TEXT
+);
+"""
+
+CASE_COLUMNS = ["case_id", "session_id", "summary", "detail", "principle_applied", "detail_analysis",
+                "new_principle", "dialog", "dialog_refs"]
+JSON_CASE_COLUMNS = ["dialog", "dialog_refs"]
+
+
+class SqliteStateStore(object):
+    """
+    SQLite (WAL mode) store for profile, cases, journal metadata and interview notes. Every thread gets its own
+    connection, so the CLI and the MCP server can read and write concurrently without rewriting whole files.
+    """
+    DB_FILE = "state.db"
+    BUSY_TIMEOUT_MS = 30000
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [r["name"] for r in conn.execute("PRAGMA table_info(cases)").fetchall()]
+            if "dialog_refs" not in columns:
+                conn.execute("ALTER TABLE cases ADD COLUMN dialog_refs TEXT")
+            # rows of the AI template recorded by earlier versions, journals always have a date
+            conn.execute("DELETE FROM journals WHERE date IS NULL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=self.BUSY_TIMEOUT_MS / 1000)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec="seconds")
+
+    # profile
+    def update_profile(self, profile: dict, overwrite: bool = True) -> int:
+        """
+        :param overwrite: Replace the value of existing keys, otherwise only missing keys are inserted.
+        :return: The number of inserted or updated keys.
+        """
+        conflict = "DO UPDATE SET value = excluded.value" if overwrite else "DO NOTHING"
+        with self._connect() as conn:
+            cursor = conn.executemany(f"INSERT INTO profile (key, value) VALUES (?, ?) ON CONFLICT(key) {conflict}",
+                                      list(profile.items()))
+            return cursor.rowcount
+
+    def load_profile(self) -> dict:
+        rows = self._connect().execute("SELECT key, value FROM profile ORDER BY key").fetchall()
+        return {r["key"]: r["value"] for r in rows}
+
+    # cases
+    def insert_case(self, case: dict, overwrite: bool = True) -> bool:
+        """
+        :param overwrite: Update an existing case, keeping its created_at, otherwise leave it untouched.
+        :return: True if the case was inserted or updated.
+        """
+        values = [json.dumps(case.get(c, [])) if c in JSON_CASE_COLUMNS else case.get(c) for c in CASE_COLUMNS]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in CASE_COLUMNS if c != "case_id")
+        conflict = f"DO UPDATE SET {updates}" if overwrite else "DO NOTHING"
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO cases ({', '.join(CASE_COLUMNS)}, created_at) "
+                f"VALUES ({', '.join(['?'] * len(CASE_COLUMNS))}, ?) ON CONFLICT(case_id) {conflict}",
+                values + [self._now()])
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _row_to_case(row: sqlite3.Row) -> dict:
+        case = {c: row[c] for c in CASE_COLUMNS}
+        for c in JSON_CASE_COLUMNS:
+            case[c] = json.loads(case[c]) if case[c] else []
+        return case
+
+    def load_cases(self) -> List[dict]:
+        rows = self._connect().execute(
+            f"SELECT {', '.join(CASE_COLUMNS)} FROM cases ORDER BY created_at, rowid").fetchall()
+        return [self._row_to_case(r) for r in rows]
+
+    def load_case(self, case_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            f"SELECT {', '.join(CASE_COLUMNS)} FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+        return self._row_to_case(row) if row is not None else None
+
+    def load_case_summaries(self) -> List[dict]:
+        rows = self._connect().execute(
+            "SELECT case_id, session_id, summary, new_principle FROM cases ORDER BY created_at, rowid").fetchall()
+        return [dict(r) for r in rows]
+
+    # journals
+    def record_journal(self, file: str, date: str, overwrite: bool = True) -> bool:
+        """
+        :param overwrite: Bump updated_at of an already recorded journal, otherwise leave it untouched.
+        :return: True if the journal was inserted or updated.
+        """
+        conflict = "DO UPDATE SET updated_at = excluded.updated_at" if overwrite else "DO NOTHING"
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"INSERT INTO journals (file, date, updated_at) VALUES (?, ?, ?) ON CONFLICT(file) {conflict}",
+                (file, date, self._now()))
+            return cursor.rowcount > 0
+
+    def list_journal_dates(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        query = "SELECT date FROM journals WHERE date IS NOT NULL"
+        params = []
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND date <= ?"
+            params.append(end)
+        rows = self._connect().execute(query + " ORDER BY date", params).fetchall()
+        return [r["date"] for r in rows]
+
+    # interview notes
+    def save_notes(self, notes):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO notes (id, content) VALUES (1, ?)", (json.dumps(notes),))
+
+    def load_notes(self):
+        row = self._connect().execute("SELECT content FROM notes WHERE id = 1").fetchone()
+        return json.loads(row["content"]) if row is not None else None
+
+    # workflow checkpoints
+    def save_checkpoint(self, session_id: str, checkpoint: dict):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO checkpoints (session_id, content, updated_at) VALUES (?, ?, ?)",
+                         (session_id, json.dumps(checkpoint), self._now()))
+
+    def load_checkpoint(self, session_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT content FROM checkpoints WHERE session_id = ?",
+                                      (session_id,)).fetchone()
+        return json.loads(row["content"]) if row is not None else None
+
+    def delete_checkpoint(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM checkpoints WHERE session_id = ?", (session_id,))
+
+    def migrate_from_json(self, store_dir: str, journal_dir: str) -> dict:
+        """
+        Import the JSON/JSONL state files and journal directory into the database. Rows already in the
+        database are kept as they are, so running the migration again only adds what is missing.
+        :return: The number of migrated records per table.
+        """
+        from core.case_log import get_case_log
+        migrated = {"profile": 0, "cases": 0, "journals": 0, "notes": 0}
+        profile_file = os.path.join(store_dir, "profile.json")
+        if os.path.exists(profile_file):
+            with open(profile_file, "r") as f:
+                migrated["profile"] = self.update_profile(json.load(f), overwrite=False)
+        for case in get_case_log(store_dir).load_all():
+            migrated["cases"] += self.insert_case(case, overwrite=False)
+        notes_file = os.path.join(store_dir, "notes.json")
+        if os.path.exists(notes_file) and self.load_notes() is None:
+            with open(notes_file, "r") as f:
+                self.save_notes(json.load(f))
+            migrated["notes"] = 1
+        if os.path.exists(journal_dir):
+            for file in sorted(os.listdir(journal_dir)):
+                if file.startswith("journal-") and file.endswith(".md"):
+                    date = file.replace("journal-", "").replace(".md", "")
+                    migrated["journals"] += self.record_journal(file, date, overwrite=False)
+        return migrated
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_sqlite_store(store_dir: str, create: bool = False) -> Optional[SqliteStateStore]:
+    """
+    Return the SQLite store under store_dir. The backend is opt-in: unless create is set, None is returned
+    until the database has been created by the migration.
+    """
+    db_file = os.path.join(store_dir, SqliteStateStore.DB_FILE)
+    with _STORES_LOCK:
+        if db_file in _STORES:
+            return _STORES[db_file]
+        if not os.path.exists(db_file):
+            if not create:
+                return None
+            os.makedirs(store_dir, exist_ok=True)
+        _STORES[db_file] = SqliteStateStore(db_file)
+        return _STORES[db_file]
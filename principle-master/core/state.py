@@ -1,10 +1,21 @@
 import json
+import logging
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional, List
 
 from llama_index.core.base.llms.types import ChatMessage
 
+from core.blob_store import BlobStore, get_blob_store, put_dialog, build_dialog_storage_report
+from core.case_log import get_case_log
+from core.sqlite_store import get_sqlite_store
+from core.user_context import user_dir, user_state_dir
+from utils.atomic_file import atomic_write
+
+logger = logging.getLogger(__name__)
+
 type Function = str
 CASE_REFLECTION: Function = "CaseReflection"
 RECORD_PROFILE: Function = "RecordProfile"
@@ -21,11 +32,16 @@ AVAILABLE_FUNCTIONS = {
     JOURNAL,
 }
 
+JOURNAL_DIR_ENV = "PRINCIPLE_MASTER_JOURNAL_DIR"
+
 CURRENT_STAGE = "CURRENT_STAGE"
 STAGE_META = "STAGE_META"
 
 
 class Profile(object):
+    __slots__ = ("mbti", "key_strength", "greatest_weakness", "one_big_challenge", "most_appreciated_values",
+                 "least_appreciated_values", "principles")
+
     def __init__(self,
                  mbti: Optional[str] = None,
                  key_strength: Optional[str] = None,
@@ -62,6 +78,7 @@ class Profile(object):
 
 
 class ReflectionCase(object):
+    __slots__ = ("case_id", "summary", "detail", "principle_applied", "detail_analysis", "new_principle", "dialog")
 
     def __init__(self,
                  case_id: str,
@@ -96,18 +113,26 @@ class ReflectionCase(object):
         return case
 
 
+
 class JournalManager(object):
+    @staticmethod
+    def base_journal_dir():
+        # PRINCIPLE_MASTER_JOURNAL_DIR points the journals elsewhere, e.g. to a scratch directory for load tests
+        return os.environ.get(JOURNAL_DIR_ENV) or \
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "journal")
+
     @staticmethod
     def local_journal_dir():
-        return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "journal")
+        return user_dir(JournalManager.base_journal_dir())
 
     BASE_TEMPLATE = "template_static.md"
     AI_TEMPLATE = "template.md"
+    PRECOMPUTED_DIR = "precomputed"
 
     def new_journal(self) -> str:
         """
-        Create a new journal file based on the available template.
-        If AI_TEMPLATE exists, use it; otherwise, fallback to BASE_TEMPLATE.
+        Create a new journal file based on the template precomputed for today, the AI_TEMPLATE, or the
+        BASE_TEMPLATE, whichever exists first.
         :return: The path to the created journal file.
         """
         journal_dir = self.local_journal_dir()
@@ -117,12 +142,12 @@ class JournalManager(object):
         today = datetime.today().strftime('%Y-%m-%d')
         journal_file = os.path.join(journal_dir, f"journal-{today}.md")
 
-        template_file = os.path.join(journal_dir, self.AI_TEMPLATE if os.path.exists(
-            os.path.join(journal_dir, self.AI_TEMPLATE)) else self.BASE_TEMPLATE)
-
-        with open(template_file, "r") as template, open(journal_file, "w") as journal:
-            journal.write(template.read().format(DATE=today))
+        with open(journal_file, "w") as journal:
+            journal.write(self.template_for(today).format(DATE=today))
 
+        store = get_state_store()
+        if store is not None:
+            store.record_journal(os.path.basename(journal_file), today)
         return journal_file
 
     def read_template(self) -> str:
@@ -131,13 +156,58 @@ class JournalManager(object):
         If AI_TEMPLATE exists, use it; otherwise, fallback to BASE_TEMPLATE.
         :return: The content of the template file.
         """
-        journal_dir = self.local_journal_dir()
-        template_file = os.path.join(journal_dir, self.AI_TEMPLATE if os.path.exists(
-            os.path.join(journal_dir, self.AI_TEMPLATE)) else self.BASE_TEMPLATE)
-
-        with open(template_file, "r") as template:
+        with open(self.template_file(), "r") as template:
             return template.read()
 
+    def template_file(self) -> str:
+        """
+        :return: The path of the AI_TEMPLATE if it exists, otherwise of the BASE_TEMPLATE shared by all users.
+        """
+        ai_template_file = os.path.join(self.local_journal_dir(), self.AI_TEMPLATE)
+        if os.path.exists(ai_template_file):
+            return ai_template_file
+        return os.path.join(self.base_journal_dir(), self.BASE_TEMPLATE)
+
+    def precomputed_template_file(self, date: str) -> str:
+        return os.path.join(self.local_journal_dir(), self.PRECOMPUTED_DIR, f"template-{date}.md")
+
+    def save_precomputed_template(self, date: str, content: str) -> str:
+        """
+        Store the template precomputed for the journal of the given date.
+        :return: The path to the precomputed template.
+        """
+        template_file = self.precomputed_template_file(date)
+        atomic_write(template_file, content)
+        return template_file
+
+    def prune_precomputed_templates(self, before: str) -> int:
+        """
+        Remove the precomputed templates of dates before the given one, their journals can no longer be created.
+        :param before: Date in YYYY-MM-DD format.
+        :return: The number of removed templates.
+        """
+        precomputed_dir = os.path.join(self.local_journal_dir(), self.PRECOMPUTED_DIR)
+        if not os.path.exists(precomputed_dir):
+            return 0
+        removed = 0
+        for file in os.listdir(precomputed_dir):
+            if file.startswith("template-") and file.endswith(".md") and file[len("template-"):-len(".md")] < before:
+                os.remove(os.path.join(precomputed_dir, file))
+                removed += 1
+        return removed
+
+    def template_for(self, date: str) -> str:
+        """
+        Template to create the journal of the given date with, preferring the one precomputed for that date.
+        :param date: Date in YYYY-MM-DD format.
+        :return: The content of the template.
+        """
+        template_file = self.precomputed_template_file(date)
+        if os.path.exists(template_file):
+            with open(template_file, "r") as template:
+                return template.read()
+        return self.read_template()
+
     def update_template(self, content: str):
         """
         Update the AI_TEMPLATE file with the provided content.
@@ -145,9 +215,25 @@ class JournalManager(object):
         """
         journal_dir = self.local_journal_dir()
         ai_template_file = os.path.join(journal_dir, self.AI_TEMPLATE)
+        atomic_write(ai_template_file, content)
 
-        with open(ai_template_file, "w") as template:
-            template.write(content)
+    def list_journal_dates(self) -> List[str]:
+        """
+        List the dates of the existing journals, oldest first.
+        :return: Dates in YYYY-MM-DD format.
+        """
+        store = get_state_store()
+        if store is not None:
+            return store.list_journal_dates()
+        journal_dir = self.local_journal_dir()
+        if not os.path.exists(journal_dir):
+            return []
+        dates = []
+        for file in os.listdir(journal_dir):
+            if file.startswith("journal-") and file.endswith(".md"):
+                dates.append(file.replace("journal-", "").replace(".md", ""))
+        dates.sort()
+        return dates
 
 
 class ProfileManager(object):
@@ -155,9 +241,13 @@ class ProfileManager(object):
 
     @staticmethod
     def local_store_dir():
-        return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notes")
+        return user_state_dir()
 
     def persist_profile(self, profile: Profile):
+        store = get_state_store()
+        if store is not None:
+            store.update_profile(profile.to_dict())
+            return "Profile updated"
         profile_dir = self.local_store_dir()
         profile_file = os.path.join(profile_dir, self.PROFILE_FILE)
         profile_dict = profile.to_dict()
@@ -174,6 +264,9 @@ class ProfileManager(object):
         return "Profile updated"
 
     def load_profile(self):
+        store = get_state_store()
+        if store is not None:
+            return store.load_profile()
         profile_dir = self.local_store_dir()
         profile_file = os.path.join(profile_dir, self.PROFILE_FILE)
         if not os.path.exists(profile_file):
@@ -184,45 +277,68 @@ class ProfileManager(object):
 
 
 class CaseManager(object):
-    CASE_FILE = "cases.json"
-
     @staticmethod
     def local_store_dir():
-        return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notes")
+        return user_state_dir()
+
+    def _blob_store(self) -> BlobStore:
+        return get_blob_store(self.local_store_dir())
 
     def persist_case(self, session_id: str, case: ReflectionCase):
-        case_dir = self.local_store_dir()
-        case_file = os.path.join(case_dir, self.CASE_FILE)
         case = case.to_dict()
         case["session_id"] = session_id
-        if not os.path.exists(case_dir):
-            os.makedirs(case_dir)
-        if os.path.exists(case_file):
-            with open(case_file, "r+") as f:
-                cases = json.load(f)
+        # dialog messages are stored once each in the blob store, the case keeps their hashes
+        case["dialog_refs"] = put_dialog(self._blob_store(), case.pop("dialog"))
+        store = get_state_store()
+        if store is not None:
+            store.insert_case(case)
         else:
-            cases = []
-        with open(case_file, "w+") as f:
-            cases.append(case)
-            json.dump(cases, f, indent=4, sort_keys=True)
-            f.write('\n')
+            get_case_log(self.local_store_dir()).append(case)
+        from core.index import get_personal_index
+        try:
+            get_personal_index().add_case(case)
+        except Exception:
+            # the case is stored, it is indexed as missing the next time the personal index is loaded
+            logger.exception("Failed to queue case %s for indexing", case["case_id"])
         return "Case stored"
 
     def load_cases(self):
-        case_dir = self.local_store_dir()
-        case_file = os.path.join(case_dir, self.CASE_FILE)
-        if not os.path.exists(case_file):
-            return []
-        with open(case_file, "r+") as f:
-            cases = json.load(f)
-        return cases
+        store = get_state_store()
+        if store is not None:
+            return store.load_cases()
+        return get_case_log(self.local_store_dir()).load_all()
+
+    def load_case(self, case_id: str) -> Optional[dict]:
+        store = get_state_store()
+        if store is not None:
+            return store.load_case(case_id)
+        return get_case_log(self.local_store_dir()).get(case_id)
+
+    def load_case_summaries(self) -> List[dict]:
+        """
+        Load case_id, session_id, summary and new_principle of every case, without the dialogs.
+        """
+        store = get_state_store()
+        if store is not None:
+            return store.load_case_summaries()
+        return get_case_log(self.local_store_dir()).load_projections()
+
+    def dialog_storage_report(self) -> dict:
+        return build_dialog_storage_report(self._blob_store(), self.load_cases())
+
+
 
-    def load_principle_from_cases(self):
-        cases = self.load_cases()
-        principles = []
-        for c in cases:
-            principles.append(c["new_principle"])
-        return principles
+def get_state_store():
+    """
+    Return the SQLite state store when it has been enabled by migrate_state_to_sqlite, otherwise None and the
+    JSON files are used.
+    """
+    return get_sqlite_store(CaseManager.local_store_dir())
+
+
+def migrate_state_to_sqlite() -> dict:
+    store = get_sqlite_store(CaseManager.local_store_dir(), create=True)
+    return store.migrate_from_json(CaseManager.local_store_dir(), JournalManager.local_journal_dir())
 
 
 class WorkflowState(CaseManager, ProfileManager, JournalManager):
@@ -231,11 +347,23 @@ class WorkflowState(CaseManager, ProfileManager, JournalManager):
         self.state = {}
 
 
-_WORKFLOW_STATE = {}
+# least recently used states are evicted beyond this size, see release_workflow_state for explicit cleanup
+MAX_WORKFLOW_STATES = 1024
+_WORKFLOW_STATE: OrderedDict[str, WorkflowState] = OrderedDict()
+_WORKFLOW_STATE_LOCK = threading.Lock()
 
 
 def get_workflow_state(uuid: str) -> WorkflowState:
-    global _WORKFLOW_STATE
-    if uuid not in _WORKFLOW_STATE:
-        _WORKFLOW_STATE[uuid] = WorkflowState()
-    return _WORKFLOW_STATE[uuid]
+    with _WORKFLOW_STATE_LOCK:
+        if uuid not in _WORKFLOW_STATE:
+            _WORKFLOW_STATE[uuid] = WorkflowState()
+            while len(_WORKFLOW_STATE) > MAX_WORKFLOW_STATES:
+                _WORKFLOW_STATE.popitem(last=False)
+        else:
+            _WORKFLOW_STATE.move_to_end(uuid)
+        return _WORKFLOW_STATE[uuid]
+
+
+def release_workflow_state(uuid: str):
+    with _WORKFLOW_STATE_LOCK:
+        _WORKFLOW_STATE.pop(uuid, None)
@@ -0,0 +1,164 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.tools import FunctionTool
+
+from core.advisor_agents import get_template_update_agent
+from core.common import run_agent
+from utils.user_channel import get_user_channel
+
+# sections the template updater may rewrite, keyed by their normalised heading
+ADVICE_SECTION = "advice for the day"
+GOALS_SECTION = "daily goals checklist"
+FOCUS_SECTION = "tomorrows focus"
+PATCHABLE_SECTIONS = (ADVICE_SECTION, GOALS_SECTION, FOCUS_SECTION)
+
+_HEADING = re.compile(r"^##\s+(.*)$")
+
+
+class TemplatePatchError(Exception):
+    pass
+
+
+class TemplateSection(object):
+    def __init__(self, heading: str, lines: List[str]):
+        self.heading = heading
+        self.lines = lines
+
+    @property
+    def key(self) -> str:
+        return normalise_heading(self.heading)
+
+    def split_separator(self) -> Tuple[List[str], List[str]]:
+        """
+        :return: The section content and the trailing blank/'---' lines separating it from the next section.
+        """
+        end = len(self.lines)
+        while end > 0 and self.lines[end - 1].strip() in ("", "---"):
+            end -= 1
+        return self.lines[:end], self.lines[end:]
+
+
+def normalise_heading(heading: str) -> str:
+    heading = _HEADING.sub(r"\1", heading)
+    return " ".join(re.sub(r"[^a-z0-9 ]", "", heading.lower()).split())
+
+
+def parse_template(template: str) -> Tuple[List[str], List[TemplateSection]]:
+    """
+    Split a markdown template into the lines before the first '## ' heading and its '## ' sections.
+    """
+    preamble = []
+    sections: List[TemplateSection] = []
+    for line in template.splitlines():
+        if _HEADING.match(line):
+            sections.append(TemplateSection(line, []))
+        elif sections:
+            sections[-1].lines.append(line)
+        else:
+            preamble.append(line)
+    return preamble, sections
+
+
+def render_template(preamble: List[str], sections: List[TemplateSection]) -> str:
+    lines = list(preamble)
+    for section in sections:
+        lines.append(section.heading)
+        lines.extend(section.lines)
+    return "\n".join(lines) + "\n"
+
+
+def apply_patch(template: str, patch: Dict[str, str]) -> str:
+    """
+    Replace the content of the given sections, keeping headings, separators and all other sections untouched.
+    :param template: The existing template.
+    :param patch: New content keyed by normalised section heading.
+    :return: The patched template.
+    """
+    preamble, sections = parse_template(template)
+    by_key = {section.key: section for section in sections}
+    for key, content in patch.items():
+        if key not in PATCHABLE_SECTIONS:
+            raise TemplatePatchError(f"Section '{key}' can not be patched")
+        if key not in by_key:
+            raise TemplatePatchError(f"Template has no section '{key}'")
+        content = content.strip().strip("`").strip()
+        if content == "":
+            raise TemplatePatchError(f"Empty content for section '{key}'")
+        if any(_HEADING.match(line) for line in content.splitlines()):
+            raise TemplatePatchError(f"Content for section '{key}' must not contain '## ' headings")
+        # journals are created with template.format(DATE=...), literal braces have to be escaped
+        content = content.replace("{", "{{").replace("}", "}}")
+        section = by_key[key]
+        _, separator = section.split_separator()
+        section.lines = [""] + content.splitlines() + separator
+    return render_template(preamble, sections)
+
+
+def get_template_patch_prompt(template: str) -> str:
+    _, sections = parse_template(template)
+    current = "\n\n".join(section.heading + "\n" + "\n".join(section.split_separator()[0]).strip()
+                          for section in sections if section.key in PATCHABLE_SECTIONS)
+    return (
+        "You are an AI assistant that updates a daily journal template based on:\n"
+        "1. Advice provided to the user.\n"
+        "2. User's specific concerns.\n\n"
+        "Call patch_template_sections with the new markdown content of each section, without the section heading:\n"
+        "- advice_for_the_day: the advice for the day.\n"
+        "- daily_goals_checklist: the checklist items reflecting the advice and concerns.\n"
+        "- tomorrows_focus: the checklist items aligned with the advice and concerns.\n\n"
+        f"Current sections:\n```\n{current}\n```\n"
+    )
+
+
+async def patch_journal_template(template: str, advice: str, question: str) -> str:
+    """
+    Ask the LLM for the new content of the patchable sections only and apply it to the template locally.
+    :return: The patched template.
+    """
+    patched: Dict[str, str] = {}
+
+    def patch_template_sections(advice_for_the_day: str, daily_goals_checklist: str, tomorrows_focus: str) -> str:
+        patched["template"] = apply_patch(template, {
+            ADVICE_SECTION: advice_for_the_day,
+            GOALS_SECTION: daily_goals_checklist,
+            FOCUS_SECTION: tomorrows_focus,
+        })
+        return "Template patched"
+
+    tool = FunctionTool.from_defaults(
+        fn=patch_template_sections,
+        name="patch_template_sections",
+        description="Replace the content of the advice, daily goals and tomorrow's focus sections of the template.",
+    )
+    chat_history = [
+        ChatMessage(role="system", content=get_template_patch_prompt(template)),
+        ChatMessage(role="assistant", content=advice),
+    ]
+    response = await Settings.llm.apredict_and_call([tool], user_msg=question, chat_history=chat_history)
+    if "template" not in patched:
+        raise TemplatePatchError(f"Template was not patched: {_error_of(response)}")
+    return patched["template"]
+
+
+def _error_of(response) -> Optional[str]:
+    sources = getattr(response, "sources", None) or []
+    return str(sources[0].content) if sources else getattr(response, "response", None)
+
+
+async def patch_or_regenerate_template(template: str, advice: str, question: str, verbose: bool = False) -> str:
+    """
+    Patch the template with the advice, regenerating the whole template when the patch fails, whether on
+    validation or in the LLM call.
+    :return: The updated template.
+    """
+    try:
+        return await patch_journal_template(template, advice, question)
+    except Exception as e:
+        if verbose:
+            await get_user_channel().say(f"Template patch failed, regenerating the template: {e}")
+    agent = get_template_update_agent(template)
+    return await run_agent(agent, question=question, chat_history=[ChatMessage(role="assistant", content=advice)],
+                           verbose=verbose)
@@ -0,0 +1,71 @@
+import contextlib
+import contextvars
+import os
+import re
+from typing import List, Optional
+
+USERS_DIR = "users"
+STATE_DIR_ENV = "PRINCIPLE_MASTER_STATE_DIR"
+_USER_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_CURRENT_USER: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("user_id", default=None)
+
+
+def set_current_user(user_id: Optional[str]):
+    """
+    Bind the current context to a user. Tasks created afterwards inherit it, worker threads have to be handed
+    the context explicitly. Without a user, the state of the single local user is used.
+    """
+    if user_id is not None and not _USER_ID.match(user_id):
+        raise ValueError(f"Invalid user id '{user_id}', use 1-64 letters, digits, '-' or '_'")
+    _CURRENT_USER.set(user_id)
+
+
+def get_current_user() -> Optional[str]:
+    return _CURRENT_USER.get()
+
+
+@contextlib.contextmanager
+def as_user(user_id: Optional[str]):
+    token = _CURRENT_USER.set(user_id)
+    try:
+        yield
+    finally:
+        _CURRENT_USER.reset(token)
+
+
+def user_dir(base_dir: str) -> str:
+    """
+    :return: The directory holding the current user's part of base_dir, base_dir itself for the local user.
+    """
+    user_id = _CURRENT_USER.get()
+    return base_dir if user_id is None else os.path.join(base_dir, USERS_DIR, user_id)
+
+
+def base_state_dir() -> str:
+    """
+    :return: The directory of the profile, cases, notes and checkpoints of all users.
+    """
+    # PRINCIPLE_MASTER_STATE_DIR points the state elsewhere, e.g. to a scratch directory for load tests
+    return os.environ.get(STATE_DIR_ENV) or \
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notes")
+
+
+def user_state_dir() -> str:
+    """
+    :return: The state directory of the current user.
+    """
+    return user_dir(base_state_dir())
+
+
+def list_users(*base_dirs: str) -> List[Optional[str]]:
+    """
+    :return: The local user (None) followed by every user with a directory under users/ of any of base_dirs.
+    """
+    users = set()
+    for base_dir in base_dirs:
+        users_dir = os.path.join(base_dir, USERS_DIR)
+        if os.path.isdir(users_dir):
+            users.update(u for u in os.listdir(users_dir)
+                         if _USER_ID.match(u) and os.path.isdir(os.path.join(users_dir, u)))
+    return [None] + sorted(users)
@@ -0,0 +1,75 @@
+import contextvars
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from rich import print
+
+from core.advisor_agents import get_principle_query_engine, warm_agent_pool
+from core.context_packer import count_tokens
+from core.index import get_local_index_store_dir, get_personal_index
+from core.intent_classifier import get_intent_classifier
+from core.state import get_workflow_state
+
+
+class Warmup(object):
+    """
+    Load what every branch of PrincipleMasterFlow needs on a thread pool while the user is reading the greeting
+    and typing their intention, so the chosen branch starts warm.
+    """
+    WORKERS = 4
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self._executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix="warmup")
+        self._futures: Dict[str, Future] = {}
+        self._timings: Dict[str, list] = {}
+        self._started_at: Optional[float] = None
+
+    def _submit(self, name: str, fn: Callable):
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                self._timings[name] = [start, time.perf_counter()]
+
+        # the worker runs in a copy of this context, so it loads the state of the session's user
+        self._futures[name] = self._executor.submit(contextvars.copy_context().run, timed)
+
+    def start(self):
+        state = get_workflow_state(self.session_id)
+        self._started_at = time.perf_counter()
+        self._submit("profile", state.load_profile)
+        self._submit("template", state.read_template)
+        self._submit("personal_index", get_personal_index().warm)
+        self._submit("tokenizer", lambda: count_tokens(""))
+        self._submit("intent_classifier", get_intent_classifier().warm)
+        if os.path.exists(get_local_index_store_dir()):
+            self._submit("query_engine", get_principle_query_engine)
+            self._submit("agents", warm_agent_pool)
+        self._executor.shutdown(wait=False)
+        return self
+
+    def future(self, name: str) -> Optional[Future]:
+        return self._futures.get(name)
+
+    def result(self, name: str):
+        return self._futures[name].result()
+
+    def report(self, ready_at: Optional[float] = None):
+        """
+        Print how long each warm-up task took and how much of it was hidden behind the user's think time.
+        :param ready_at: perf_counter timestamp when the user's intention was known, defaults to now.
+        """
+        ready_at = time.perf_counter() if ready_at is None else ready_at
+        print(f"Startup warm-up (user think time {ready_at - self._started_at:.2f}s):")
+        for name, future in self._futures.items():
+            if name not in self._timings:
+                print(f"  {name}: still running")
+                continue
+            start, end = self._timings[name]
+            hidden = max(0.0, min(end, ready_at) - start)
+            status = "failed" if future.exception() is not None else "ok"
+            print(f"  {name}: {end - start:.2f}s, {hidden:.2f}s hidden ({status})")
@@ -8,16 +8,18 @@ from llama_index.core import Settings
 from llama_index.core.base.llms.types import ChatMessage
 from llama_index.core.memory import BaseMemory, ChatMemoryBuffer
 from llama_index.core.workflow import Context, Workflow, step, StartEvent, StopEvent, Event
-from rich import print
 
 from core.advice_agent_flow import get_advice_dynamic_workflow, get_static_workflow
 from core.case_reflection import CaseReflectionAgent
+from core.checkpoint import SessionCheckpoint, UnknownSessionError, load_messages
 from core.index import get_local_index_store_dir
 from core.intention import IntentionDetectionAgent
 from core.profile import ProfileUpdateAgent
 from core.state import CASE_REFLECTION, ROUTING, ENDING, get_workflow_state, AVAILABLE_FUNCTIONS, \
     RECORD_PROFILE, ADVISE, JOURNAL
+from core.warmup import Warmup
 from utils.llm import get_embedding, get_config, get_llm
+from utils.user_channel import get_user_channel, TerminalChannel
 
 
 class CaseReflectionEvent(Event):
@@ -48,13 +50,20 @@ class PrincipleMasterFlow(Workflow):
         f"{chr(10).join(list(AVAILABLE_FUNCTIONS))}\n")
 
     def __init__(self, memory: Optional[BaseMemory] = None, verbose: bool = False,
-                 is_dynamic_advice_flow: bool = False):
+                 is_dynamic_advice_flow: bool = False, is_pipelined_advice_flow: bool = False,
+                 session_id: Optional[str] = None, memory_token_limit: Optional[int] = None,
+                 is_batch_profile: bool = False):
         self.memory = memory
         self.verbose = verbose
-        self.session_id = str(uuid.uuid4())
+        self.session_id = str(uuid.uuid4()) if session_id is None else session_id
+        self.memory_token_limit = TOKEN_LIMIT if memory_token_limit is None else memory_token_limit
         self.state = get_workflow_state(self.session_id)
         self.conf = get_config()
         self.is_dynamic_advice_flow = is_dynamic_advice_flow
+        self.is_pipelined_advice_flow = is_pipelined_advice_flow
+        self.is_batch_profile = is_batch_profile
+        self.warmup = None
+        self.checkpoint = SessionCheckpoint(self.session_id)
         super().__init__(timeout=None, verbose=verbose)
 
     EVENT_MAP = {
@@ -69,61 +78,104 @@ class PrincipleMasterFlow(Workflow):
     @step
     async def start(self, ctx: Context,
                     ev: StartEvent) -> CaseReflectionEvent | RecordProfileEvent | Advice | JournalEvent | StopEvent:
+        channel = get_user_channel()
+        route = self.checkpoint.get("route")
+        if route is not None:
+            await channel.say(f"Resuming session {self.session_id} at {route}.")
+            self.warmup = Warmup(self.session_id).start()
+            return self.EVENT_MAP[route](input=route)
         agent = IntentionDetectionAgent(session_id=self.session_id, tools=[], memory=self.memory,
                                         verbose=self.verbose)
-        print(self.GREETING)
+        await channel.say(self.GREETING)
+        await channel.say(f"Session {self.session_id}, resume it with --resume {self.session_id} if interrupted.")
+        self.warmup = Warmup(self.session_id).start()
         self.memory.put(ChatMessage(
             role="assistant",
             content=self.GREETING,
         ))
-        response = agent.start_chat()
+        response = await agent.astart_chat()
+        if self.verbose:
+            self.warmup.report()
+        if response != ENDING:
+            self.checkpoint.save("route", response)
         event_class = self.EVENT_MAP[response]
         return event_class(input=response)
 
     @step
     async def case_reflection(self, ctx: Context, ev: CaseReflectionEvent) -> StopEvent:
-        refresh_memory = ChatMemoryBuffer.from_defaults(token_limit=TOKEN_LIMIT)
+        refresh_memory = ChatMemoryBuffer.from_defaults(token_limit=self.memory_token_limit)
         agent = CaseReflectionAgent(session_id=self.session_id, memory=refresh_memory,
-                                    verbose=self.verbose)
-        response = agent.start_chat("Instruct me what should I do")
+                                    verbose=self.verbose, checkpoint=self.checkpoint)
+        saved_memory = self.checkpoint.get(CaseReflectionAgent.CHECKPOINT_KEY)
+        if saved_memory is None:
+            response = await agent.astart_chat("Instruct me what should I do")
+            return StopEvent(input=response)
+        # pick the dialog up where it stopped, with the last question asked to the user
+        messages = load_messages(saved_memory)
+        agent.memory.set(messages)
+        if messages and messages[-1].role == "assistant":
+            await agent.say(messages[-1].content)
+        response = await agent.astart_chat("")
         return StopEvent(input=response)
 
     @step
     async def record_profile(self, ctx: Context, ev: RecordProfileEvent) -> StopEvent:
-        agent = ProfileUpdateAgent(session_id=self.session_id, verbose=self.verbose)
-        response = agent.start_chat("Instruct me what should I do")
+        agent = ProfileUpdateAgent(session_id=self.session_id, verbose=self.verbose, checkpoint=self.checkpoint,
+                                   batch=self.is_batch_profile)
+        response = await agent.astart_chat("Instruct me what should I do")
         return StopEvent(input=response)
 
     @step
     async def advice(self, ctx: Context, ev: Advice) -> StopEvent:
         if not os.path.exists(get_local_index_store_dir()):
-            print("Advice function can be used only after you have index some book content. Please use the 'index-content' function first.")
+            await get_user_channel().say("Advice function can be used only after you have index some book content. Please use the 'index-content' function first.")
             return StopEvent(result="Done")
-        uer_question = input("How can I help you today?")
-        workflow = get_advice_dynamic_workflow(session_id=self.session_id) if self.is_dynamic_advice_flow else \
-            get_static_workflow(session_id=self.session_id, verbose=self.verbose)
+        channel = get_user_channel()
+        uer_question = self.checkpoint.get("user_msg")
+        if uer_question is None:
+            uer_question = await channel.ask("How can I help you today?")
+            self.checkpoint.save("user_msg", uer_question)
+        workflow = get_advice_dynamic_workflow(session_id=self.session_id, warmup=self.warmup) \
+            if self.is_dynamic_advice_flow else \
+            get_static_workflow(session_id=self.session_id, verbose=self.verbose,
+                                pipelined=self.is_pipelined_advice_flow, warmup=self.warmup,
+                                checkpoint=self.checkpoint)
         advise = await workflow.run(user_msg=uer_question)
-        print(advise)
+        await channel.say(str(advise))
         return StopEvent(result="Done")
 
     @step
     async def write_journal(self, ctx: Context, ev: JournalEvent) -> StopEvent:
-        print("Write your journal")
+        channel = get_user_channel()
+        await channel.say("Write your journal")
         new_journal_file = self.state.new_journal()
-        # sleep here because I am lazy to implement a io lock, wait for verbose log to finish first.
-        await asyncio.sleep(1)
-        subprocess.run(["vim", new_journal_file])
+        if not isinstance(channel, TerminalChannel):
+            # remote users have no terminal to run the editor in
+            await channel.say(f"Journal created at {new_journal_file}")
+            return StopEvent(result="Done")
+        # the editor owns the terminal until it exits
+        async with channel.output_lock:
+            await asyncio.to_thread(subprocess.run, ["vim", new_journal_file])
         return StopEvent(result="Done")
 
 
 TOKEN_LIMIT = 40000
 
 
-async def run_customise_workflow(verbose: bool = False, is_dynamic_advice_flow: bool = False):
+async def run_customise_workflow(verbose: bool = False, is_dynamic_advice_flow: bool = False,
+                                 is_pipelined_advice_flow: bool = False, resume_session_id: Optional[str] = None,
+                                 is_batch_profile: bool = False):
+    if resume_session_id is not None and not SessionCheckpoint(resume_session_id).exists():
+        raise UnknownSessionError(f"No interrupted session {resume_session_id} to resume, it completed or never "
+                                  f"started")
     llm = get_llm()
     Settings.llm = llm
     embed_model = get_embedding()
     Settings.embed_model = embed_model
     memory = ChatMemoryBuffer.from_defaults(token_limit=TOKEN_LIMIT)
-    workflow = PrincipleMasterFlow(memory=memory, verbose=verbose, is_dynamic_advice_flow=is_dynamic_advice_flow)
+    workflow = PrincipleMasterFlow(memory=memory, verbose=verbose, is_dynamic_advice_flow=is_dynamic_advice_flow,
+                                   is_pipelined_advice_flow=is_pipelined_advice_flow, session_id=resume_session_id,
+                                   is_batch_profile=is_batch_profile)
     _ = await workflow.run()
+    # the run completed, nothing is left to resume
+    workflow.checkpoint.clear()
@@ -1,14 +1,29 @@
 import asyncio
+import logging
 import os
 
 import click
 from llama_index.core import Settings
 
+from core.batch import run_batch_advice, DEFAULT_CONCURRENCY
 from core.index import create_and_persist_index_from_path
+from core.precompute import run_precompute, RECENT_JOURNALS
+from core.server import run_server, MAX_SESSIONS, SESSION_TTL_SECONDS
+from core.state import migrate_state_to_sqlite, CaseManager
+from core.checkpoint import UnknownSessionError
 from core.workflow import run_customise_workflow
 from utils.llm import get_embedding, write_config
 
 
+def configure_logging(verbose: bool):
+    """
+    Show the info logs of the flows, such as the intent fast path hit rate and the items the adviser context packer
+    dropped, with --verbose and only warnings otherwise.
+    """
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
 @click.group()
 def consult():
     click.echo("Principle Master is ready!")
@@ -18,8 +33,32 @@ def consult():
 @click.command()
 @click.option('--verbose', is_flag=True)
 @click.option("--dynamic", is_flag=True)
-def principle_master(verbose, dynamic):
-    asyncio.run(run_customise_workflow(verbose=verbose, is_dynamic_advice_flow=dynamic))
+@click.option("--pipelined", is_flag=True)
+@click.option("--resume", "resume_session_id", default=None, help="Resume an interrupted session by its id.")
+@click.option("--batch-profile", is_flag=True, help="Ask all profile questions first and evaluate them together.")
+def principle_master(verbose, dynamic, pipelined, resume_session_id, batch_profile):
+    configure_logging(verbose)
+    try:
+        asyncio.run(run_customise_workflow(verbose=verbose, is_dynamic_advice_flow=dynamic,
+                                           is_pipelined_advice_flow=pipelined, resume_session_id=resume_session_id,
+                                           is_batch_profile=batch_profile))
+    except UnknownSessionError as e:
+        raise click.BadParameter(str(e), param_hint="--resume")
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8765, type=int)
+@click.option("--unix-socket", default=None, help="Serve on a Unix socket instead of TCP.")
+@click.option("--max-sessions", default=MAX_SESSIONS, type=int)
+@click.option("--session-ttl", default=SESSION_TTL_SECONDS, type=float, help="Idle seconds before a session is evicted.")
+@click.option('--verbose', is_flag=True)
+@click.option("--dynamic", is_flag=True)
+@click.option("--pipelined", is_flag=True)
+def serve(host, port, unix_socket, max_sessions, session_ttl, verbose, dynamic, pipelined):
+    asyncio.run(run_server(host=host, port=port, unix_socket=unix_socket, max_sessions=max_sessions,
+                           ttl_seconds=session_ttl, verbose=verbose, is_dynamic_advice_flow=dynamic,
+                           is_pipelined_advice_flow=pipelined))
 
 
 @click.command()
@@ -50,6 +89,7 @@ def config_llm():
 @click.argument("pdf_path")
 @click.option("--verbose", is_flag=True)
 def index_content(pdf_path, verbose):
+    configure_logging(verbose)
     print(f"Indexing pdf under this path {pdf_path}")
     embed_model = get_embedding()
     Settings.embed_model = embed_model
@@ -57,8 +97,49 @@ def index_content(pdf_path, verbose):
     print(f" Index completed. ")
 
 
+@click.command()
+@click.argument("input_path")
+@click.argument("output_path")
+@click.option("--concurrency", default=DEFAULT_CONCURRENCY, type=int)
+@click.option("--pipelined", is_flag=True)
+@click.option("--verbose", is_flag=True)
+def batch_advice(input_path, output_path, concurrency, pipelined, verbose):
+    configure_logging(verbose)
+    asyncio.run(run_batch_advice(input_path, output_path, concurrency=concurrency, pipelined=pipelined))
+
+
+@click.command()
+@click.option("--date", default=None, help="Date in YYYY-MM-DD format to precompute for, defaults to today before noon and tomorrow after.")
+@click.option("--recent", default=RECENT_JOURNALS, type=int, help="Number of latest journals to take into account.")
+@click.option("--force", is_flag=True, help="Precompute even if nothing changed since the last run.")
+@click.option("--verbose", is_flag=True)
+def precompute_journal(date, recent, force, verbose):
+    configure_logging(verbose)
+    asyncio.run(run_precompute(date=date, recent=recent, force=force))
+
+
+@click.command()
+def migrate_state():
+    migrated = migrate_state_to_sqlite()
+    print(f"State migrated to SQLite: {migrated}")
+
+
+@click.command()
+def dialog_storage_report():
+    report = CaseManager().dialog_storage_report()
+    print(f"Cases with stored dialogs: {report['cases']}")
+    print(f"Messages referenced: {report['messages']} ({report['unique_messages']} unique)")
+    print(f"Inline size: {report['inline_bytes']} bytes, stored size: {report['stored_bytes']} bytes")
+    print(f"Saved: {report['saved_bytes']} bytes")
+
+
 consult.add_command(principle_master)
+consult.add_command(serve)
+consult.add_command(batch_advice)
+consult.add_command(precompute_journal)
 consult.add_command(index_content)
 consult.add_command(config_llm)
+consult.add_command(migrate_state)
+consult.add_command(dialog_storage_report)
 if __name__ == '__main__':
     consult()
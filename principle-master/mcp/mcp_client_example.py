@@ -3,24 +3,40 @@
 Example MCP client to test the principle-master journaling server.
 
 This script demonstrates how to use the MCP server for journal management.
+By default it spawns the server over stdio, pass --url to test a running HTTP server, e.g.
+python mcp_server.py --transport http --port 8000
+python mcp_client_example.py --url http://localhost:8000/mcp
 """
 
+import argparse
 import asyncio
+import contextlib
 import json
 import subprocess
 import sys
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
 
 
-async def test_mcp_server():
+@contextlib.asynccontextmanager
+async def connect(url: str = None):
+    """Yield the read and write streams of a stdio or streamable HTTP connection to the server."""
+    if url is None:
+        server_params = StdioServerParameters(
+            command="python3",
+            args=["mcp_server.py"]
+        )
+        async with stdio_client(server_params) as (read, write):
+            yield read, write
+    else:
+        async with streamablehttp_client(url) as (read, write, _):
+            yield read, write
+
+
+async def test_mcp_server(url: str = None):
     """Test the MCP server functionality."""
-    server_params = StdioServerParameters(
-        command="python3",
-        args=["mcp_server.py"]
-    )
-    
-    async with stdio_client(server_params) as (read, write):
+    async with connect(url) as (read, write):
         async with ClientSession(read, write) as session:
             # Initialize the session
             await session.initialize()
@@ -110,4 +126,7 @@ This is a test journal entry created via MCP server!
 
 
 if __name__ == "__main__":
-    asyncio.run(test_mcp_server())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None, help="Streamable HTTP endpoint, e.g. http://localhost:8000/mcp")
+    args = parser.parse_args()
+    asyncio.run(test_mcp_server(args.url))
\ No newline at end of file
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Load test for the principle-master journaling MCP server.
+
+Runs N concurrent simulated hosts, each with its own ClientSession, issuing a weighted mix of tool calls and
+resource reads against a journal directory seeded with years of synthetic entries. Reports throughput and
+p50/p95/p99 latency per operation.
+
+Over stdio every host spawns its own server on the seeded directory:
+python mcp_load_test.py --hosts 8 --requests 200
+Over HTTP all hosts share one server, which has to be started on the same directory:
+PRINCIPLE_MASTER_JOURNAL_DIR=/tmp/journals PRINCIPLE_MASTER_STATE_DIR=/tmp/journals/state \
+    python mcp_server.py --transport http --no-search-index
+python mcp_load_test.py --url http://localhost:8000/mcp --journal-dir /tmp/journals
+
+The spawned servers keep their state under the state/ subdirectory of the journal directory, so the journals
+written by the test never reach the real state store.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from pydantic import AnyUrl
+
+MCP_DIR = os.path.dirname(os.path.abspath(__file__))
+PRINCIPLE_MASTER_DIR = os.path.dirname(MCP_DIR)
+JOURNAL_DIR_ENV = "PRINCIPLE_MASTER_JOURNAL_DIR"
+STATE_DIR_ENV = "PRINCIPLE_MASTER_STATE_DIR"
+STATE_SUBDIR = "state"
+
+DEFAULT_MIX = "read_journal=4,list_journals=2,read_resource=2,write_journal_content=1,create_journal=1"
+RESOURCES = [
+    "principle-master://journal/template",
+    "principle-master://journal/list",
+    "principle-master://journal/etags",
+]
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def synthetic_journal(day: date, rng: random.Random) -> str:
+    moods = ["focused", "tired", "curious", "frustrated", "calm", "energetic"]
+    lines = [f"# 📅 Daily Journal — {day.isoformat()}", "", "## Advice for the Day", ""]
+    lines.append(f"Felt {rng.choice(moods)} today. " * rng.randint(3, 12))
+    lines += ["", "## ✅ Daily Goals / Checklist", ""]
+    lines += [f"- [{rng.choice([' ', 'x'])}] Task {i}" for i in range(rng.randint(2, 6))]
+    return "\n".join(lines) + "\n"
+
+
+def seed_journals(journal_dir: str, years: int, seed: int) -> List[str]:
+    """
+    Write one synthetic journal per day for the given number of years, ending yesterday.
+    :return: The seeded dates.
+    """
+    rng = random.Random(seed)
+    os.makedirs(journal_dir, exist_ok=True)
+    shutil.copy(os.path.join(PRINCIPLE_MASTER_DIR, "journal", "template_static.md"),
+                os.path.join(journal_dir, "template_static.md"))
+    end = date.today() - timedelta(days=1)
+    dates = []
+    for i in range(years * 365, 0, -1):
+        day = end - timedelta(days=i - 1)
+        with open(os.path.join(journal_dir, f"journal-{day.isoformat()}.md"), "w") as f:
+            f.write(synthetic_journal(day, rng))
+        dates.append(day.isoformat())
+    return dates
+
+
+@contextlib.asynccontextmanager
+async def connect(url: Optional[str], journal_dir: str):
+    if url is None:
+        env = dict(os.environ)
+        env[JOURNAL_DIR_ENV] = journal_dir
+        env[STATE_DIR_ENV] = os.path.join(journal_dir, STATE_SUBDIR)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PRINCIPLE_MASTER_DIR, env.get("PYTHONPATH")]))
+        server_params = StdioServerParameters(
+            command=sys.executable,
+            args=[os.path.join(MCP_DIR, "mcp_server.py"), "--no-search-index"],
+            env=env,
+        )
+        async with stdio_client(server_params) as (read, write):
+            yield read, write
+    else:
+        async with streamablehttp_client(url) as (read, write, _):
+            yield read, write
+
+
+class SimulatedHost(object):
+    def __init__(self, host_id: int, host_count: int, dates: List[str], weights: Dict[str, int], seed: int):
+        self.host_id = host_id
+        self.host_count = host_count
+        self.dates = dates
+        self.rng = random.Random(seed + host_id)
+        self.operations = list(weights.keys())
+        self.weights = list(weights.values())
+        self.latencies: Dict[str, List[float]] = {op: [] for op in self.operations}
+        self.errors: Dict[str, int] = {op: 0 for op in self.operations}
+        self._created = 0
+
+    async def _call(self, session: ClientSession, op: str):
+        if op == "read_journal":
+            return await session.call_tool("read_journal", {"date": self.rng.choice(self.dates)})
+        if op == "write_journal_content":
+            day = self.rng.choice(self.dates)
+            return await session.call_tool("write_journal_content", {
+                "date": day, "content": synthetic_journal(date.fromisoformat(day), self.rng)})
+        if op == "create_journal":
+            # hosts create interleaved future dates, so they do not collide
+            self._created += 1
+            day = date.today() + timedelta(days=self._created * self.host_count + self.host_id)
+            return await session.call_tool("create_journal", {"date": day.isoformat()})
+        if op == "list_journals":
+            start = date.fromisoformat(self.rng.choice(self.dates))
+            return await session.call_tool("list_journals", {
+                "start": start.isoformat(), "end": (start + timedelta(days=30)).isoformat(), "limit": 50})
+        if op == "read_resource":
+            return await session.read_resource(AnyUrl(self.rng.choice(RESOURCES)))
+        raise ValueError(f"Unknown operation: {op}")
+
+    async def run(self, url: Optional[str], journal_dir: str, requests: int):
+        async with connect(url, journal_dir) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                for _ in range(requests):
+                    op = self.rng.choices(self.operations, weights=self.weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        result = await self._call(session, op)
+                        if getattr(result, "isError", False):
+                            self.errors[op] += 1
+                    except Exception:
+                        self.errors[op] += 1
+                    self.latencies[op].append(time.perf_counter() - started)
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def report(hosts: List[SimulatedHost], elapsed: float) -> dict:
+    operations = {}
+    for host in hosts:
+        for op, latencies in host.latencies.items():
+            entry = operations.setdefault(op, {"latencies": [], "errors": 0})
+            entry["latencies"].extend(latencies)
+            entry["errors"] += host.errors[op]
+    result = {"elapsed_seconds": elapsed, "operations": {}}
+    total = 0
+    print(f"{'operation':<24}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, entry in sorted(operations.items()):
+        latencies = entry["latencies"]
+        if not latencies:
+            continue
+        total += len(latencies)
+        stats = {
+            "count": len(latencies),
+            "errors": entry["errors"],
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+        result["operations"][op] = stats
+        print(f"{op:<24}{stats['count']:>8}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    result["throughput"] = total / elapsed
+    print(f"Total: {total} operations in {elapsed:.1f}s, {result['throughput']:.1f} ops/s")
+    return result
+
+
+async def run_load_test(args):
+    journal_dir = args.journal_dir or tempfile.mkdtemp(prefix="principle-master-load-")
+    try:
+        started = time.perf_counter()
+        dates = seed_journals(journal_dir, args.years, args.seed)
+        print(f"Seeded {len(dates)} journals in {journal_dir} ({time.perf_counter() - started:.1f}s)")
+        hosts = [SimulatedHost(i, args.hosts, dates, parse_mix(args.mix), args.seed) for i in range(args.hosts)]
+        started = time.perf_counter()
+        await asyncio.gather(*[host.run(args.url, journal_dir, args.requests) for host in hosts])
+        result = report(hosts, time.perf_counter() - started)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    finally:
+        if args.journal_dir is None and not args.keep:
+            shutil.rmtree(journal_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the principle-master journaling MCP server")
+    parser.add_argument("--hosts", type=int, default=8, help="Concurrent simulated hosts")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per host")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted operation mix, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--years", type=int, default=3, help="Years of synthetic daily journals to seed")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", default=None, help="Streamable HTTP endpoint, spawns stdio servers if not given")
+    parser.add_argument("--journal-dir", default=None,
+                        help="Journal directory to seed, a temporary one if not given (required with --url)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary journal directory")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+    if args.url is not None and args.journal_dir is None:
+        parser.error("--journal-dir is required with --url, start the server with "
+                     f"{JOURNAL_DIR_ENV} pointing to the same directory and {STATE_DIR_ENV} to its "
+                     f"{STATE_SUBDIR} subdirectory")
+    asyncio.run(run_load_test(args))
@@ -6,37 +6,100 @@ Exposes journaling functionality from principle-master to allow other LLM hosts
 to create and manage journals via the Model Context Protocol.
 """
 
+import argparse
 import asyncio
+import contextlib
 import json
 import logging
 import os
 import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
 
 # Add the principle-master directory to the Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "principle-master"))
 
-from mcp.server import Server
+from mcp.server import NotificationOptions, Server
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from mcp.server.stdio import stdio_server
 from mcp.types import (
     Resource,
+    ResourceTemplate,
     Tool,
     TextContent,
 )
+from llama_index.core import Settings
 from mcp.shared.exceptions import McpError
+from pydantic import AnyUrl
 
-from core.state import JournalManager, WorkflowState
+from core.index import get_cached_index, get_local_index_store_dir, get_personal_index, search_book
+from core.journal_index import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, JournalIndex
+from core.resource_cache import CachedContent, FileCache, content_etag
+from core.state import JournalManager, WorkflowState, get_state_store
+from utils.atomic_file import atomic_write
+from utils.llm import get_embedding
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("principle-master-mcp")
 
+# Clients are told of resource changes whatever the transport. Journal changes go out as resources/updated, the
+# advertised resources themselves are fixed
+NOTIFICATION_OPTIONS = NotificationOptions(resources_changed=True)
+
+
+class JournalServer(Server):
+    """
+    Server advertising NOTIFICATION_OPTIONS by default, as the HTTP session manager creates the initialization
+    options without any.
+    """
+
+    def create_initialization_options(self, notification_options: Optional[NotificationOptions] = None,
+                                      experimental_capabilities: Optional[Dict[str, Dict[str, Any]]] = None):
+        return super().create_initialization_options(notification_options or NOTIFICATION_OPTIONS,
+                                                     experimental_capabilities)
+
+
 # Initialize the MCP server
-app = Server("principle-master-journal")
+app = JournalServer("principle-master-journal")
 
 # Create a global journal manager instance
 journal_manager = JournalManager()
+# Sorted journal dates, rescanned only when the journal directory changes
+journal_index = JournalIndex(journal_manager.local_journal_dir())
+
+# All file I/O runs on this bounded pool, so a slow disk access does not stall the event loop
+IO_WORKERS = 8
+MAX_BATCH_ENTRIES = 366
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="journal-io")
+
+
+# Searches embed the query remotely, they run on their own pool so they do not hold up file I/O
+SEARCH_WORKERS = 4
+DEFAULT_SEARCH_TOP_K = 5
+MAX_SEARCH_TOP_K = 20
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+
+
+async def _io(fn, *args, executor: ThreadPoolExecutor = io_executor):
+    """Run blocking file I/O on the I/O pool."""
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+TEMPLATE_URI = "principle-master://journal/template"
+LIST_URI = "principle-master://journal/list"
+COUNT_URI = "principle-master://journal/count"
+ETAGS_URI = "principle-master://journal/etags"
+
+# Resource contents are cached until the underlying files change, subscribers are notified of changes
+WATCH_INTERVAL_SECONDS = 2.0
+file_cache = FileCache()
+_list_cache: Optional[CachedContent] = None
+# weak, so that sessions closed without unsubscribing are dropped
+subscriptions: Dict[str, "weakref.WeakSet[Any]"] = {}
 
 
 @app.list_tools()
@@ -83,10 +146,30 @@ async def list_tools() -> List[Tool]:
         ),
         Tool(
             name="list_journals",
-            description="List all existing journal files",
+            description="List existing journal dates in ascending order, optionally within a date range. All dates "
+                        "are listed unless a limit or cursor is given, then one page is returned with the cursor "
+                        "of the next one",
             inputSchema={
                 "type": "object",
-                "properties": {},
+                "properties": {
+                    "start": {
+                        "type": "string",
+                        "description": "First date to include, YYYY-MM-DD"
+                    },
+                    "end": {
+                        "type": "string",
+                        "description": "Last date to include, YYYY-MM-DD"
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "Next cursor returned by the previous page"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": f"Page size (defaults to {DEFAULT_PAGE_SIZE} with a cursor, at most "
+                                       f"{MAX_PAGE_SIZE})"
+                    }
+                },
                 "additionalProperties": False
             }
         ),
@@ -123,13 +206,115 @@ async def list_tools() -> List[Tool]:
                 "required": ["date", "content"],
                 "additionalProperties": False
             }
+        ),
+        Tool(
+            name="read_journals",
+            description=f"Read several journals in one call, by a list of dates or a date range "
+                        f"(at most {MAX_BATCH_ENTRIES}, larger ranges are rejected). Returns JSON with the content or error of every date",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "dates": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Dates in YYYY-MM-DD format"
+                    },
+                    "start": {
+                        "type": "string",
+                        "description": "First date of the range, YYYY-MM-DD"
+                    },
+                    "end": {
+                        "type": "string",
+                        "description": "Last date of the range, YYYY-MM-DD"
+                    }
+                },
+                "additionalProperties": False
+            }
+        ),
+        Tool(
+            name="write_journals",
+            description=f"Write several journals in one call (at most {MAX_BATCH_ENTRIES}, one entry per date). "
+                        f"Returns JSON with the result or error of every entry",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "entries": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                                "content": {"type": "string", "description": "Content to write to the journal"}
+                            },
+                            "required": ["date", "content"]
+                        }
+                    }
+                },
+                "required": ["entries"],
+                "additionalProperties": False
+            }
+        ),
+        Tool(
+            name="search_principles",
+            description="Search the indexed Principles book. Returns JSON with the closest chunks and their scores",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "What to look up in the book"
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": f"Number of chunks (defaults to {DEFAULT_SEARCH_TOP_K}, "
+                                       f"at most {MAX_SEARCH_TOP_K})"
+                    }
+                },
+                "required": ["query"],
+                "additionalProperties": False
+            }
+        ),
+        Tool(
+            name="search_my_cases",
+            description="Search the user's own reflection cases, and optionally journals. "
+                        "Returns JSON with the closest entries and their scores",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "What to look up in the user's history"
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": f"Number of entries (defaults to {DEFAULT_SEARCH_TOP_K}, "
+                                       f"at most {MAX_SEARCH_TOP_K})"
+                    },
+                    "include_journals": {
+                        "type": "boolean",
+                        "description": "Also search journals (defaults to false)"
+                    }
+                },
+                "required": ["query"],
+                "additionalProperties": False
+            }
         )
     ]
 
 
+# Tool calls beyond this limit wait for a slot, shared by all clients of the process
+MAX_CONCURRENT_TOOL_CALLS = 32
+tool_limiter = asyncio.Semaphore(MAX_CONCURRENT_TOOL_CALLS)
+
+
 @app.call_tool()
 async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
     """Handle tool calls for journal management."""
+    async with tool_limiter:
+        return await _dispatch_tool(name, arguments)
+
+
+async def _dispatch_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
     try:
         if name == "create_journal":
             return await create_journal_tool(arguments)
@@ -143,6 +328,14 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             return await read_journal_tool(arguments)
         elif name == "write_journal_content":
             return await write_journal_content_tool(arguments)
+        elif name == "read_journals":
+            return await read_journals_tool(arguments)
+        elif name == "write_journals":
+            return await write_journals_tool(arguments)
+        elif name == "search_principles":
+            return await search_principles_tool(arguments)
+        elif name == "search_my_cases":
+            return await search_my_cases_tool(arguments)
         else:
             raise McpError(f"Unknown tool: {name}")
     except Exception as e:
@@ -155,44 +348,44 @@ async def create_journal_tool(arguments: Dict[str, Any]) -> List[TextContent]:
     date_str = arguments.get("date")
     
     if date_str:
-        try:
-            # Validate date format
-            datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            raise McpError("Date must be in YYYY-MM-DD format")
+        _validate_date(date_str)
     else:
         date_str = datetime.today().strftime("%Y-%m-%d")
     
-    # Create custom journal manager for specific date
-    journal_dir = journal_manager.local_journal_dir()
-    if not os.path.exists(journal_dir):
-        os.makedirs(journal_dir)
-    
-    journal_file = os.path.join(journal_dir, f"journal-{date_str}.md")
+    created, journal_file = await _io(_create_journal_file, date_str)
     
     # Check if journal already exists
-    if os.path.exists(journal_file):
+    if not created:
         return [TextContent(
             type="text",
             text=f"Journal for {date_str} already exists at: {journal_file}"
         )]
     
-    # Get template content
-    template_content = journal_manager.read_template()
-    
-    # Create journal with date substitution
-    with open(journal_file, "w") as f:
-        f.write(template_content.format(DATE=date_str))
-    
     return [TextContent(
         type="text",
         text=f"Journal created successfully for {date_str} at: {journal_file}"
     )]
 
 
+def _create_journal_file(date_str: str):
+    journal_file = os.path.join(journal_manager.local_journal_dir(), f"journal-{date_str}.md")
+    if os.path.exists(journal_file):
+        return False, journal_file
+    # Get template content, the nightly precomputed one if available
+    template_content = journal_manager.template_for(date_str)
+    # Create journal with date substitution, unless another request created it meanwhile
+    if not atomic_write(journal_file, template_content.format(DATE=date_str), exclusive=True):
+        return False, journal_file
+    journal_index.add(date_str)
+    store = get_state_store()
+    if store is not None:
+        store.record_journal(os.path.basename(journal_file), date_str)
+    return True, journal_file
+
+
 async def get_journal_template_tool(arguments: Dict[str, Any]) -> List[TextContent]:
     """Get the current journal template."""
-    template_content = journal_manager.read_template()
+    template_content = await _io(journal_manager.read_template)
     return [TextContent(
         type="text",
         text=template_content
@@ -205,41 +398,67 @@ async def update_journal_template_tool(arguments: Dict[str, Any]) -> List[TextCo
     if not content:
         raise McpError("Content is required")
     
-    journal_manager.update_template(content)
+    await _io(journal_manager.update_template, content)
     return [TextContent(
         type="text",
         text="Journal template updated successfully"
     )]
 
 
+def _validate_date(date_str: str, name: str = "Date"):
+    if not date_str:
+        raise McpError(f"{name} is required")
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        raise McpError(f"{name} must be in YYYY-MM-DD format")
+
+
+def _parse_limit(limit) -> Optional[int]:
+    if limit is None or limit == "":
+        return None
+    try:
+        return int(limit)
+    except (TypeError, ValueError):
+        raise McpError("limit must be an integer")
+
+
+def _query_journals(start: Optional[str], end: Optional[str], cursor: Optional[str], limit):
+    """
+    Query the journal dates in range. Without cursor and limit, all of them are returned in one page.
+    """
+    for name, value in (("start", start), ("end", end), ("cursor", cursor)):
+        if value:
+            _validate_date(value, name)
+    limit = _parse_limit(limit)
+    if limit is None and cursor:
+        limit = DEFAULT_PAGE_SIZE
+    return journal_index.query(start=start or None, end=end or None, cursor=cursor or None, limit=limit)
+
+
 async def list_journals_tool(arguments: Dict[str, Any]) -> List[TextContent]:
-    """List all existing journal files."""
-    journal_dir = journal_manager.local_journal_dir()
-    
-    if not os.path.exists(journal_dir):
+    """List existing journal dates within an optional date range, one page at a time."""
+    if not await _io(os.path.exists, journal_manager.local_journal_dir()):
         return [TextContent(
             type="text",
             text="No journal directory found"
         )]
     
-    journal_files = []
-    for file in os.listdir(journal_dir):
-        if file.startswith("journal-") and file.endswith(".md"):
-            # Extract date from filename
-            date_part = file.replace("journal-", "").replace(".md", "")
-            journal_files.append(date_part)
+    # the query may rescan the journal directory
+    page = await _io(_query_journals, arguments.get("start"), arguments.get("end"), arguments.get("cursor"),
+                     arguments.get("limit"))
     
-    journal_files.sort()
-    
-    if not journal_files:
+    if page.total == 0:
         return [TextContent(
             type="text",
             text="No journal files found"
         )]
     
+    text = f"Found {page.total} journal files, showing {len(page.dates)} of {page.total}:\n" + "\n".join(page.dates)
+    text += f"\nNext cursor: {page.next_cursor if page.next_cursor is not None else 'none, this is the last page'}"
     return [TextContent(
         type="text",
-        text=f"Found {len(journal_files)} journal files:\n" + "\n".join(journal_files)
+        text=text
     )]
 
 
@@ -249,20 +468,7 @@ async def read_journal_tool(arguments: Dict[str, Any]) -> List[TextContent]:
     if not date_str:
         raise McpError("Date is required")
     
-    try:
-        # Validate date format
-        datetime.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        raise McpError("Date must be in YYYY-MM-DD format")
-    
-    journal_dir = journal_manager.local_journal_dir()
-    journal_file = os.path.join(journal_dir, f"journal-{date_str}.md")
-    
-    if not os.path.exists(journal_file):
-        raise McpError(f"Journal for {date_str} not found")
-    
-    with open(journal_file, "r") as f:
-        content = f.read()
+    content = await _io(_read_journal_file, date_str)
     
     return [TextContent(
         type="text",
@@ -280,20 +486,7 @@ async def write_journal_content_tool(arguments: Dict[str, Any]) -> List[TextCont
     if not content:
         raise McpError("Content is required")
     
-    try:
-        # Validate date format
-        datetime.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        raise McpError("Date must be in YYYY-MM-DD format")
-    
-    journal_dir = journal_manager.local_journal_dir()
-    if not os.path.exists(journal_dir):
-        os.makedirs(journal_dir)
-    
-    journal_file = os.path.join(journal_dir, f"journal-{date_str}.md")
-    
-    with open(journal_file, "w") as f:
-        f.write(content)
+    await _io(_write_journal_file, date_str, content)
     
     return [TextContent(
         type="text",
@@ -301,6 +494,123 @@ async def write_journal_content_tool(arguments: Dict[str, Any]) -> List[TextCont
     )]
 
 
+def _read_journal_file(date_str: str) -> str:
+    _validate_date(date_str)
+    journal_file = os.path.join(journal_manager.local_journal_dir(), f"journal-{date_str}.md")
+    if not os.path.exists(journal_file):
+        raise McpError(f"Journal for {date_str} not found")
+    with open(journal_file, "r") as f:
+        return f.read()
+
+
+def _write_journal_file(date_str: str, content: str):
+    _validate_date(date_str)
+    if not content:
+        raise McpError("Content is required")
+    journal_file = os.path.join(journal_manager.local_journal_dir(), f"journal-{date_str}.md")
+    atomic_write(journal_file, content)
+    journal_index.add(date_str)
+    store = get_state_store()
+    if store is not None:
+        store.record_journal(os.path.basename(journal_file), date_str)
+
+
+async def _run_batch(fn, entries: List[tuple]) -> List[Dict[str, Any]]:
+    """Run fn for every entry on the I/O pool, collecting the result or error of each entry."""
+    outcomes = await asyncio.gather(*[_io(fn, *entry) for entry in entries], return_exceptions=True)
+    results = []
+    for entry, outcome in zip(entries, outcomes):
+        result = {"date": entry[0]}
+        if isinstance(outcome, Exception):
+            result["error"] = str(outcome)
+        elif outcome is not None:
+            result["content"] = outcome
+        else:
+            result["status"] = "written"
+        results.append(result)
+    return results
+
+
+async def read_journals_tool(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Read the journals of a list of dates or of a date range."""
+    dates = arguments.get("dates")
+    start, end = arguments.get("start"), arguments.get("end")
+    if dates is None:
+        if not start and not end:
+            raise McpError("Either dates or a start/end range is required")
+        page = await _io(_query_journals, start, end, None, None)
+        if page.total > MAX_BATCH_ENTRIES:
+            raise McpError(f"The range holds {page.total} journals, at most {MAX_BATCH_ENTRIES} can be read at "
+                           f"once, narrow the range")
+        dates = page.dates
+    if len(dates) > MAX_BATCH_ENTRIES:
+        raise McpError(f"At most {MAX_BATCH_ENTRIES} journals can be read at once")
+    results = await _run_batch(_read_journal_file, [(date,) for date in dates])
+    return [TextContent(
+        type="text",
+        text=json.dumps({"journals": results})
+    )]
+
+
+async def write_journals_tool(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Write several journals at once."""
+    entries = arguments.get("entries")
+    if not entries:
+        raise McpError("Entries are required")
+    if len(entries) > MAX_BATCH_ENTRIES:
+        raise McpError(f"At most {MAX_BATCH_ENTRIES} journals can be written at once")
+    dates = [e.get("date") for e in entries]
+    duplicates = sorted({d for d in dates if dates.count(d) > 1}, key=str)
+    if duplicates:
+        # concurrent writes of the same journal would leave an arbitrary one of them
+        raise McpError(f"Duplicate dates in entries: {', '.join(map(str, duplicates))}")
+    results = await _run_batch(_write_journal_file, [(e.get("date"), e.get("content")) for e in entries])
+    return [TextContent(
+        type="text",
+        text=json.dumps({"journals": results})
+    )]
+
+
+def _search_args(arguments: Dict[str, Any]):
+    query = arguments.get("query")
+    if not query:
+        raise McpError("Query is required")
+    top_k = int(arguments.get("top_k") or DEFAULT_SEARCH_TOP_K)
+    return query, min(max(top_k, 1), MAX_SEARCH_TOP_K)
+
+
+def _search_results(nodes) -> List[TextContent]:
+    results = [{"text": n.get_content(), "score": n.score, "metadata": n.node.metadata} for n in nodes]
+    return [TextContent(
+        type="text",
+        text=json.dumps({"results": results})
+    )]
+
+
+async def search_principles_tool(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Search the book index loaded at startup."""
+    query, top_k = _search_args(arguments)
+    if not os.path.exists(get_local_index_store_dir()):
+        raise McpError("No book has been indexed yet, run 'index-content' first")
+    nodes = await _io(search_book, query, top_k, executor=search_executor)
+    return _search_results(nodes)
+
+
+async def search_my_cases_tool(arguments: Dict[str, Any]) -> List[TextContent]:
+    """Search the personal index of cases and journals loaded at startup."""
+    query, top_k = _search_args(arguments)
+    doc_type = None if arguments.get("include_journals") else "case"
+    nodes = await _io(get_personal_index().search, query, top_k, doc_type, executor=search_executor)
+    return _search_results(nodes)
+
+
+def load_search_indexes():
+    """Load the book and personal indexes into memory, so searches are answered from warm indexes."""
+    if os.path.exists(get_local_index_store_dir()):
+        get_cached_index()
+    get_personal_index().warm()
+
+
 @app.list_resources()
 async def list_resources() -> List[Resource]:
     """List available resources."""
@@ -316,37 +626,229 @@ async def list_resources() -> List[Resource]:
             name="Journal List",
             description="List of all available journal entries",
             mimeType="application/json"
+        ),
+        Resource(
+            uri="principle-master://journal/count",
+            name="Journal Count",
+            description="Number of available journal entries",
+            mimeType="application/json"
+        ),
+        Resource(
+            uri=ETAGS_URI,
+            name="Resource ETags",
+            description="Content hashes of the template, list and count resources, "
+                        "re-read a resource only when its ETag changed",
+            mimeType="application/json"
+        )
+    ]
+
+
+@app.list_resource_templates()
+async def list_resource_templates() -> List[ResourceTemplate]:
+    """List parameterised resources."""
+    return [
+        ResourceTemplate(
+            uriTemplate="principle-master://journal/list{?start,end,cursor,limit}",
+            name="Journal Page",
+            description="Journal dates within [start, end], all of them unless paginated with cursor and limit. "
+                        "Returns {dates, total, next_cursor}",
+            mimeType="application/json"
+        ),
+        ResourceTemplate(
+            uriTemplate="principle-master://journal/count{?start,end}",
+            name="Journal Range Count",
+            description="Number of journal entries within [start, end]",
+            mimeType="application/json"
         )
     ]
 
 
 @app.read_resource()
-async def read_resource(uri: str) -> str:
-    """Read a specific resource."""
-    if uri == "principle-master://journal/template":
-        return journal_manager.read_template()
-    elif uri == "principle-master://journal/list":
-        journal_dir = journal_manager.local_journal_dir()
-        if not os.path.exists(journal_dir):
-            return json.dumps([])
-        
-        journal_files = []
-        for file in os.listdir(journal_dir):
-            if file.startswith("journal-") and file.endswith(".md"):
-                date_part = file.replace("journal-", "").replace(".md", "")
-                journal_files.append(date_part)
-        
-        journal_files.sort()
-        return json.dumps(journal_files)
+async def read_resource(uri: str) -> List[ReadResourceContents]:
+    """Read a specific resource, its ETag is returned in the `_meta` of the contents."""
+    parts = urlsplit(str(uri))
+    params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    resource = _resource_key(uri)
+    if resource == TEMPLATE_URI:
+        cached = await _io(_template_resource)
+        return _resource_contents(cached.content, "text/markdown", cached.etag)
+    elif resource == ETAGS_URI:
+        return _resource_contents(json.dumps(await _io(_current_etags)))
+    elif resource == LIST_URI:
+        if not params:
+            cached = await _io(_list_resource)
+            return _resource_contents(cached.content, etag=cached.etag)
+        page = await _io(_query_journals, params.get("start"), params.get("end"), params.get("cursor"),
+                         params.get("limit"))
+        return _resource_contents(json.dumps(page.to_dict()))
+    elif resource == COUNT_URI:
+        start, end = params.get("start"), params.get("end")
+        for name, value in (("start", start), ("end", end)):
+            if value:
+                _validate_date(value, name)
+        content = json.dumps({"total": await _io(journal_index.count, start, end)})
+        if not params:
+            # the count changes with the list, so it carries the list's ETag as in the etags resource
+            return _resource_contents(content, etag=(await _io(_list_resource)).etag)
+        return _resource_contents(content)
     else:
         raise McpError(f"Resource not found: {uri}")
 
 
+def _resource_contents(content: str, mime_type: str = "application/json",
+                       etag: Optional[str] = None) -> List[ReadResourceContents]:
+    return [ReadResourceContents(content=content, mime_type=mime_type,
+                                 meta={"etag": content_etag(content) if etag is None else etag})]
+
+
+def _resource_key(uri) -> str:
+    parts = urlsplit(str(uri))
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def _template_resource() -> CachedContent:
+    return file_cache.read(journal_manager.template_file())
+
+
+def _list_resource() -> CachedContent:
+    global _list_cache
+    journal_index.refresh()
+    cached = _list_cache
+    if cached is not None and cached.stamp == journal_index.version:
+        return cached
+    version = journal_index.version
+    content = json.dumps(journal_index.query().dates)
+    _list_cache = CachedContent(content, content_etag(content), version)
+    return _list_cache
+
+
+def _current_etags() -> Dict[str, str]:
+    list_etag = _list_resource().etag
+    return {
+        TEMPLATE_URI: _template_resource().etag,
+        LIST_URI: list_etag,
+        COUNT_URI: list_etag,
+    }
+
+
+@app.subscribe_resource()
+async def subscribe_resource(uri: AnyUrl) -> None:
+    """Notify the requesting session whenever the resource changes."""
+    subscriptions.setdefault(_resource_key(uri), weakref.WeakSet()).add(app.request_context.session)
+
+
+@app.unsubscribe_resource()
+async def unsubscribe_resource(uri: AnyUrl) -> None:
+    subscriptions.get(_resource_key(uri), weakref.WeakSet()).discard(app.request_context.session)
+
+
+async def _notify(uri: str):
+    for session in list(subscriptions.get(uri, ())):
+        try:
+            await session.send_resource_updated(AnyUrl(uri))
+        except Exception as e:
+            logger.info(f"Dropping subscription of a closed session to {uri}: {str(e)}")
+            subscriptions[uri].discard(session)
+
+
+async def watch_resources():
+    """
+    Poll the stat of the template and journal directory and notify subscribers of changed resources. Journals
+    added or removed update the list and count resources, the advertised resources themselves never change.
+    """
+    etags = await _io(_current_etags)
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL_SECONDS)
+        try:
+            current = await _io(_current_etags)
+        except Exception as e:
+            logger.error(f"Error watching resources: {str(e)}")
+            continue
+        changed = [uri for uri, etag in current.items() if etags.get(uri) != etag]
+        for uri in changed:
+            await _notify(uri)
+        if changed:
+            await _notify(ETAGS_URI)
+        etags = current
+
+
+# load tests and journal-only deployments skip loading the search indexes and the embedding model
+LOAD_SEARCH_INDEXES = True
+
+
+@contextlib.asynccontextmanager
+async def server_lifespan():
+    """Load the search indexes and watch resources for as long as the server runs."""
+    if LOAD_SEARCH_INDEXES:
+        try:
+            Settings.embed_model = get_embedding()
+            await _io(load_search_indexes, executor=search_executor)
+        except Exception as e:
+            # journal tools work without an embedding model, only the search tools need it
+            logger.warning(f"Search indexes not loaded: {str(e)}")
+    watcher = asyncio.create_task(watch_resources())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
 async def main():
     """Main entry point for the MCP server."""
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(read_stream, write_stream, app.create_initialization_options())
+    async with server_lifespan():
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(read_stream, write_stream, app.create_initialization_options())
+
+
+def create_http_app(json_response: bool = False):
+    """
+    Streamable HTTP transport, served at /mcp. Many hosts share the process, its indexes and caches.
+    """
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+
+    session_manager = StreamableHTTPSessionManager(app=app, json_response=json_response)
+
+    async def handle_mcp(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(starlette_app):
+        async with server_lifespan():
+            async with session_manager.run():
+                yield
+
+    return Starlette(routes=[Mount("/mcp", app=handle_mcp)], lifespan=lifespan)
+
+
+def serve_http(host: str, port: int, max_connections: int, keep_alive: int, json_response: bool = False):
+    import uvicorn
+
+    logger.info(f"Serving MCP over streamable HTTP on http://{host}:{port}/mcp")
+    # connections beyond max_connections are answered with 503 instead of queueing
+    uvicorn.run(create_http_app(json_response=json_response), host=host, port=port,
+                limit_concurrency=max_connections, timeout_keep_alive=keep_alive)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Principle Master journal MCP server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default="stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-connections", type=int, default=256,
+                        help="Concurrent HTTP connections, including open streams")
+    parser.add_argument("--max-concurrent-tools", type=int, default=MAX_CONCURRENT_TOOL_CALLS,
+                        help="Tool calls executed at once across all clients")
+    parser.add_argument("--keep-alive", type=int, default=30, help="Seconds to keep idle HTTP connections open")
+    parser.add_argument("--json-response", action="store_true",
+                        help="Answer with plain JSON instead of SSE streams")
+    parser.add_argument("--no-search-index", action="store_true",
+                        help="Do not load the search indexes at startup")
+    args = parser.parse_args()
+    tool_limiter = asyncio.Semaphore(args.max_concurrent_tools)
+    LOAD_SEARCH_INDEXES = not args.no_search_index
+    if args.transport == "http":
+        serve_http(args.host, args.port, args.max_connections, args.keep_alive, json_response=args.json_response)
+    else:
+        asyncio.run(main())
\ No newline at end of file
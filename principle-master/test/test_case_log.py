@@ -0,0 +1,145 @@
+import json
+import os
+
+from core.case_log import CaseLog
+
+
+def _case(case_id, summary="summary", session_id="session"):
+    return {"case_id": case_id, "session_id": session_id, "summary": summary, "detail": "detail",
+            "new_principle": f"principle of {case_id}"}
+
+
+def test_append_and_get(tmp_path):
+    log = CaseLog(str(tmp_path))
+    log.append(_case("a"))
+    log.append(_case("b"))
+
+    assert log.get("a") == _case("a")
+    assert log.get("b") == _case("b")
+    assert log.get("missing") is None
+    assert [c["case_id"] for c in log.load_all()] == ["a", "b"]
+    assert log.load_projections()[1] == {"case_id": "b", "session_id": "session", "summary": "summary",
+                                         "new_principle": "principle of b"}
+
+    reopened = CaseLog(str(tmp_path))
+    assert reopened.get("b") == _case("b")
+    assert reopened.load_all() == log.load_all()
+
+
+def test_latest_record_wins(tmp_path):
+    log = CaseLog(str(tmp_path))
+    log.append(_case("a"))
+    log.append(_case("b"))
+    log.append(_case("a", summary="updated"))
+
+    assert log.get("a")["summary"] == "updated"
+    assert [c["case_id"] for c in log.load_all()] == ["b", "a"]
+    assert [p["summary"] for p in log.load_projections()] == ["summary", "updated"]
+
+
+def test_recovers_truncated_last_record(tmp_path):
+    log = CaseLog(str(tmp_path))
+    log.append(_case("a"))
+    log.append(_case("b"))
+    # an append interrupted half way, before its index line was written
+    with open(log.log_file, "ab") as f:
+        f.write(CaseLog._encode(_case("c"))[:20])
+
+    recovered = CaseLog(str(tmp_path))
+    assert [c["case_id"] for c in recovered.load_all()] == ["a", "b"]
+    assert recovered.get("c") is None
+    with open(recovered.log_file, "rb") as f:
+        assert f.read().endswith(b"\n")
+
+    recovered.append(_case("c"))
+    assert recovered.get("c") == _case("c")
+    assert [c["case_id"] for c in CaseLog(str(tmp_path)).load_all()] == ["a", "b", "c"]
+
+
+def test_recovers_record_missing_from_index(tmp_path):
+    log = CaseLog(str(tmp_path))
+    log.append(_case("a"))
+    # the record was written but the process died before the index line
+    CaseLog._append(log.log_file, CaseLog._encode(_case("b")))
+
+    recovered = CaseLog(str(tmp_path))
+    assert recovered.get("b") == _case("b")
+    assert [p["case_id"] for p in recovered.load_projections()] == ["a", "b"]
+
+
+def test_compaction_keeps_latest_versions(tmp_path):
+    log = CaseLog(str(tmp_path))
+    for version in range(3):
+        for case_id in ("a", "b"):
+            log.append(_case(case_id, summary=f"v{version}"))
+    log.append(_case("c"))
+
+    log.compact()
+
+    with open(log.log_file, "rb") as f:
+        records = [json.loads(line) for line in f]
+    assert [(c["case_id"], c["summary"]) for c in records] == [("a", "v2"), ("b", "v2"), ("c", "summary")]
+    assert log.load_all() == records
+    assert log.get("a")["summary"] == "v2"
+    with open(log.index_file, "r") as f:
+        assert len(f.readlines()) == 3
+
+    reopened = CaseLog(str(tmp_path))
+    assert reopened.load_all() == records
+    assert [p["summary"] for p in reopened.load_projections()] == ["v2", "v2", "summary"]
+
+
+def test_compaction_runs_in_background(tmp_path):
+    log = CaseLog(str(tmp_path))
+    log.COMPACTION_MIN_RECORDS = 4
+    for version in range(4):
+        log.append(_case("a", summary=f"v{version}"))
+    log._compaction.join()
+
+    with open(log.log_file, "rb") as f:
+        assert len(f.readlines()) == 1
+    assert log.get("a")["summary"] == "v3"
+
+
+def test_instances_share_the_log(tmp_path):
+    first = CaseLog(str(tmp_path))
+    second = CaseLog(str(tmp_path))
+    first.append(_case("a"))
+    second.append(_case("b"))
+    first.append(_case("c"))
+
+    assert [c["case_id"] for c in first.load_all()] == ["a", "b", "c"]
+    assert [c["case_id"] for c in second.load_all()] == ["a", "b", "c"]
+    assert second.get("c") == _case("c")
+    assert [p["case_id"] for p in first.load_projections()] == ["a", "b", "c"]
+
+
+def test_instance_sees_compaction_of_another(tmp_path):
+    first = CaseLog(str(tmp_path))
+    second = CaseLog(str(tmp_path))
+    first.append(_case("a"))
+    first.append(_case("a", summary="updated"))
+    assert second.get("a")["summary"] == "updated"
+
+    first.compact()
+    second.append(_case("b"))
+
+    assert first.get("a")["summary"] == "updated"
+    assert [c["case_id"] for c in first.load_all()] == ["a", "b"]
+    assert [c["case_id"] for c in second.load_all()] == ["a", "b"]
+
+
+def test_imports_legacy_cases(tmp_path):
+    legacy = [_case("a"), _case("b")]
+    with open(os.path.join(str(tmp_path), CaseLog.LEGACY_FILE), "w") as f:
+        json.dump(legacy, f)
+
+    log = CaseLog(str(tmp_path))
+    assert log.load_all() == legacy
+    assert log.get("b") == _case("b")
+    assert [p["case_id"] for p in log.load_projections()] == ["a", "b"]
+    assert not os.path.exists(log.legacy_file)
+    assert os.path.exists(log.legacy_file + CaseLog.IMPORTED_SUFFIX)
+
+    log.append(_case("c"))
+    assert [c["case_id"] for c in CaseLog(str(tmp_path)).load_all()] == ["a", "b", "c"]
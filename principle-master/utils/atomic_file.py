@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+# reading the umask means setting it, which is not thread safe, so it is read once at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(path: str) -> int:
+    """
+    :return: The permissions of path if it exists, those open() would create it with otherwise.
+    """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def atomic_write(path: str, content: str, exclusive: bool = False) -> bool:
+    """
+    Write content to a temporary file next to path and rename it into place, so readers never see a partly
+    written file. The file keeps the permissions of the one it replaces.
+    :param path: The file to write.
+    :param content: The text content.
+    :param exclusive: Do not replace an existing file.
+    :return: False if exclusive and the file already exists, True otherwise.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file with mode 0600
+        os.fchmod(fd, _file_mode(path))
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if not exclusive:
+            os.replace(tmp, path)
+            return True
+        try:
+            # link fails if the file exists, so concurrent creators can not overwrite each other
+            os.link(tmp, path)
+        except FileExistsError:
+            return False
+        return True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -2,9 +2,20 @@ import json
 import os
 from typing import Optional
 
+from core.sqlite_store import get_sqlite_store
+from core.user_context import user_state_dir
+
+
+def _notes_dir():
+    return user_state_dir()
+
 
 def save_interview_notes(notes):
-    notes_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notes")
+    notes_dir = _notes_dir()
+    store = get_sqlite_store(notes_dir)
+    if store is not None:
+        store.save_notes(notes)
+        return
     notes_file = os.path.join(notes_dir, "notes.json")
     if not os.path.exists(notes_dir):
         os.makedirs(notes_dir)
@@ -14,7 +25,10 @@ def save_interview_notes(notes):
 
 
 def load_interview_notes() -> Optional[dict]:
-    notes_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "./notes/notes.json")  # Change this to your actual PDF file path
+    store = get_sqlite_store(_notes_dir())
+    if store is not None:
+        return store.load_notes()
+    notes_file = os.path.join(_notes_dir(), "notes.json")
     if not os.path.isfile(notes_file):
         return None
     with open(notes_file) as f:
@@ -0,0 +1,42 @@
+import fcntl
+import os
+import threading
+
+
+class FileLock(object):
+    """
+    Exclusive lock shared by the threads of this process and, through flock on a lock file, by other processes
+    such as the CLI, the MCP server and the nightly job. Re-entrant within a thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth == 0:
+            # closing the descriptor releases the flock
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+from typing import List, Optional
+
+from rich import print as rich_print
+
+
+class UserChannel(object):
+    """
+    Async interface to talk to the user. Agents and tools ask and print through the channel of the current
+    context instead of calling input()/print() on the event loop, so other sessions and background work keep
+    running while the user types.
+    """
+
+    def __init__(self):
+        self.output_lock = asyncio.Lock()
+
+    async def say(self, msg: str):
+        async with self.output_lock:
+            await self._write(msg)
+
+    async def ask(self, prompt: str = ">>") -> str:
+        # hold the output lock so the question is not interleaved with other output
+        async with self.output_lock:
+            return await self._read(prompt)
+
+    async def _write(self, msg: str):
+        raise Exception("Not implemented")
+
+    async def _read(self, prompt: str) -> str:
+        raise Exception("Not implemented")
+
+
+class TerminalChannel(UserChannel):
+    """
+    Terminal channel. input() runs on a worker thread so the event loop is not blocked.
+    """
+
+    async def _write(self, msg: str):
+        rich_print(msg)
+
+    async def _read(self, prompt: str) -> str:
+        return await asyncio.to_thread(input, prompt)
+
+
+class QueueChannel(UserChannel):
+    """
+    Channel backed by asyncio queues, for driving a session from code (tests, batch jobs, servers).
+    """
+
+    def __init__(self, inbox: Optional[asyncio.Queue] = None, outbox: Optional[asyncio.Queue] = None):
+        super().__init__()
+        self.inbox = asyncio.Queue() if inbox is None else inbox
+        self.outbox = asyncio.Queue() if outbox is None else outbox
+
+    async def _write(self, msg: str):
+        await self.outbox.put(msg)
+
+    async def _read(self, prompt: str) -> str:
+        await self.outbox.put(prompt)
+        return await self.inbox.get()
+
+
+class ScriptedChannel(UserChannel):
+    """
+    Headless channel that answers questions from a fixed list of replies and collects everything said.
+    Once the replies run out, every question is answered with the default reply.
+    """
+
+    def __init__(self, replies: List[str], default_reply: str = ""):
+        super().__init__()
+        self.replies = list(replies)
+        self.default_reply = default_reply
+        self.transcript: List[str] = []
+
+    async def _write(self, msg: str):
+        self.transcript.append(msg)
+
+    async def _read(self, prompt: str) -> str:
+        self.transcript.append(prompt)
+        reply = self.replies.pop(0) if self.replies else self.default_reply
+        self.transcript.append(reply)
+        return reply
+
+
+class SocketChannel(UserChannel):
+    """
+    Line-based channel over an asyncio stream, e.g. a TCP or Unix socket connection.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+
+    async def _write(self, msg: str):
+        self.writer.write((str(msg) + "\n").encode("utf8"))
+        await self.writer.drain()
+
+    async def _read(self, prompt: str) -> str:
+        self.writer.write(prompt.encode("utf8"))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("User channel closed")
+        return line.decode("utf8").rstrip("\r\n")
+
+
+_CURRENT_CHANNEL: contextvars.ContextVar[Optional[UserChannel]] = contextvars.ContextVar("user_channel",
+                                                                                          default=None)
+
+
+def set_user_channel(channel: UserChannel):
+    """
+    Bind a channel to the current context. Tasks created afterwards inherit it.
+    """
+    _CURRENT_CHANNEL.set(channel)
+
+
+_TERMINAL_CHANNEL: Optional[TerminalChannel] = None
+
+
+def get_user_channel() -> UserChannel:
+    """
+    Return the channel bound to the current context, falling back to the process-wide terminal.
+    """
+    global _TERMINAL_CHANNEL
+    channel = _CURRENT_CHANNEL.get()
+    if channel is not None:
+        return channel
+    if _TERMINAL_CHANNEL is None:
+        _TERMINAL_CHANNEL = TerminalChannel()
+    return _TERMINAL_CHANNEL